@@ -0,0 +1,18 @@
+"""
+ASGI config for CollegeERP project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``uvicorn CollegeERP.asgi:application``, to
+run the async views of the JSON API (info/api.py) without a thread per request.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CollegeERP.settings')
+
+application = get_asgi_application()
@@ -29,6 +29,8 @@ ALLOWED_HOSTS = ['*']
 
 AUTH_USER_MODEL = 'info.User'
 
+AUTHENTICATION_BACKENDS = ['info.backends.RoleModelBackend']
+
 
 # Application definition
 
@@ -52,6 +54,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# ERP_INSTRUMENTATION=1 times every request and its SQL, see info/middleware.py.
+if os.environ.get('ERP_INSTRUMENTATION') == '1':
+    MIDDLEWARE.insert(0, 'info.middleware.InstrumentationMiddleware')
+
 ROOT_URLCONF = 'CollegeERP.urls'
 
 TEMPLATES = [
@@ -77,11 +83,108 @@ WSGI_APPLICATION = 'CollegeERP.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# ERP_DB_BACKEND picks one of the backends below; ERP_DB_NAME, ERP_DB_USER,
+# ERP_DB_PASSWORD, ERP_DB_HOST, ERP_DB_PORT and ERP_DB_CONN_MAX_AGE override its settings.
+
+DATABASE_BACKENDS = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Seconds a write waits for the lock before failing. Every connection
+        # also switches to write-ahead logging, see info/db.py.
+        'OPTIONS': {'timeout': 20},
+    },
+    # Needs psycopg2 (psycopg2-binary in requirements.txt).
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'collegeerp',
+        'USER': 'collegeerp',
+        'PASSWORD': '',
+        'HOST': 'localhost',
+        'PORT': '5432',
+        # Keep each worker's connection open between requests, and check it is
+        # still usable before reusing it.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'connect_timeout': 5},
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_BACKENDS[os.environ.get('ERP_DB_BACKEND', 'sqlite')],
+}
+for key in ('NAME', 'USER', 'PASSWORD', 'HOST', 'PORT'):
+    if 'ERP_DB_' + key in os.environ:
+        DATABASES['default'][key] = os.environ['ERP_DB_' + key]
+if 'ERP_DB_CONN_MAX_AGE' in os.environ:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ['ERP_DB_CONN_MAX_AGE'])
+
+
+# Cache
+# ERP_CACHE_BACKEND picks one of the backends below; ERP_CACHE_LOCATION overrides its location.
+# Writes invalidate cached pages by bumping versions kept in the cache itself
+# (see info/caching.py), so every process that writes, web workers and
+# management commands alike, must share it: 'file' for processes on one
+# host, 'redis' across hosts. 'locmem' is private to each process and only
+# safe with a single web process and no command writing while it runs.
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'collegeerp',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Needs redis.
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+CACHES = {
+    'default': dict(CACHE_BACKENDS[os.environ.get('ERP_CACHE_BACKEND', 'file')],
+                    TIMEOUT=int(os.environ.get('ERP_CACHE_TIMEOUT', 3600))),
+}
+if 'ERP_CACHE_LOCATION' in os.environ:
+    CACHES['default']['LOCATION'] = os.environ['ERP_CACHE_LOCATION']
+
+
+# Email, for the nightly shortage digest.
+# ERP_EMAIL_BACKEND is 'console' (the default) or 'smtp'; the other variables configure the SMTP server.
+
+EMAIL_BACKEND = 'django.core.mail.backends.%s.EmailBackend' % os.environ.get('ERP_EMAIL_BACKEND', 'console')
+EMAIL_HOST = os.environ.get('ERP_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('ERP_EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('ERP_EMAIL_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('ERP_EMAIL_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('ERP_EMAIL_USE_TLS') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('ERP_EMAIL_FROM', 'webmaster@localhost')
+
+
+# Logging
+# The instrumentation middleware logs one JSON line per request to info.requests.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'info.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('ERP_REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
 }
 
 
@@ -1,9 +1,13 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
+from info.admin import at_risk, request_stats
 
 urlpatterns = [
+    path('admin/request_stats/', admin.site.admin_view(request_stats), name='request_stats'),
+    path('admin/at_risk/', admin.site.admin_view(at_risk), name='at_risk'),
     path('admin/', admin.site.urls),
+    path('api/v1/', include('info.api')),
     path('', include('info.urls')),
     path('info/', include('info.urls')),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='info/login.html'), name='login'),
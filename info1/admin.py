@@ -1,29 +1,19 @@
-from datetime import timedelta, datetime
+from datetime import datetime
 
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.auth.admin import UserAdmin
 from django.http import HttpResponseRedirect
+from django.shortcuts import render
 from django.urls import path
 
-from .models import Dept, Class, Student, Attendance, Course, Teacher, Assign, AssignTime, AttendanceClass
-from .models import StudentCourse, Marks, User, AttendanceRange
+from . import exports, middleware
+from .models import Dept, Class, Student, Course, Teacher, Assign, AssignTime, Attendance, AttendanceClass
+from .models import StudentCourse, Marks, User, Job, AttendanceTotal, DAYS_OF_WEEK, MIN_ATTENDANCE, time_slots
 
 # Register your models here.
 
-days = {
-    'Monday': 1,
-    'Tuesday': 2,
-    'Wednesday': 3,
-    'Thursday': 4,
-    'Friday': 5,
-    'Saturday': 6,
-}
-
-
-def daterange(start_date, end_date):
-    for n in range(int((end_date - start_date).days)):
-        yield start_date + timedelta(n)
-
 
 class ClassInline(admin.TabularInline):
     model = Class
@@ -35,6 +25,11 @@ class DeptAdmin(admin.ModelAdmin):
     list_display = ('name', 'id')
     search_fields = ('name', 'id')
     ordering = ['name']
+    actions = ['export_report']
+
+    def export_report(self, request, queryset):
+        return exports.csv_response(exports.dept_report(list(queryset.values_list('id', flat=True))), 'report.csv')
+    export_report.short_description = 'Export attendance and CIE report'
 
 
 class StudentInline(admin.TabularInline):
@@ -44,6 +39,7 @@ class StudentInline(admin.TabularInline):
 
 class ClassAdmin(admin.ModelAdmin):
     list_display = ('id', 'dept', 'sem', 'section')
+    list_select_related = ('dept',)
     search_fields = ('id', 'dept__name', 'sem', 'section')
     ordering = ['dept__name', 'sem', 'section']
     inlines = [StudentInline]
@@ -51,6 +47,7 @@ class ClassAdmin(admin.ModelAdmin):
 
 class CourseAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'dept')
+    list_select_related = ('dept',)
     search_fields = ('id', 'name', 'dept__name')
     ordering = ['dept', 'id']
 
@@ -63,9 +60,35 @@ class AssignTimeInline(admin.TabularInline):
 class AssignAdmin(admin.ModelAdmin):
     inlines = [AssignTimeInline]
     list_display = ('class_id', 'course', 'teacher')
+    list_select_related = ('class_id__dept', 'course', 'teacher')
     search_fields = ('class_id__dept__name', 'class_id__id', 'course__name', 'teacher__name', 'course__shortname')
     ordering = ['class_id__dept__name', 'class_id__id', 'course__id']
     raw_id_fields = ['class_id', 'course', 'teacher']
+    actions = ['delete_selected', 'delete_in_background', 'provision_selected']
+
+    def delete_in_background(self, request, queryset):
+        """Ask for confirmation, then queue the deletion; the confirming POST carries ``post``."""
+        if request.POST.get('post'):
+            job = Job.objects.enqueue('delete_assigns', ids=list(queryset.values_list('id', flat=True)))
+            self.message_user(request, "Deletion queued as job %d, see Jobs for its progress." % job.id)
+            return None
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Are you sure?',
+            opts=self.model._meta,
+            queryset=queryset.select_related('class_id', 'course', 'teacher'),
+            action_checkbox_name=ACTION_CHECKBOX_NAME,
+            classes=AttendanceClass.objects.filter(assign__in=queryset).count(),
+            attendance=Attendance.objects.filter(attendanceclass__assign__in=queryset).count(),
+        )
+        return render(request, 'admin/delete_assigns_confirmation.html', context)
+    delete_in_background.short_description = 'Delete selected assigns in the background'
+    delete_in_background.allowed_permissions = ('delete',)
+
+    def provision_selected(self, request, queryset):
+        job = Job.objects.enqueue('provision_assigns', ids=list(queryset.values_list('id', flat=True)))
+        self.message_user(request, "Creating the missing marks queued as job %d." % job.id)
+    provision_selected.short_description = 'Create missing marks of selected assigns in the background'
 
 
 class MarksInline(admin.TabularInline):
@@ -76,24 +99,44 @@ class MarksInline(admin.TabularInline):
 class StudentCourseAdmin(admin.ModelAdmin):
     inlines = [MarksInline]
     list_display = ('student', 'course',)
+    list_select_related = ('student', 'course')
     search_fields = ('student__name', 'course__name', 'student__class_id__id', 'student__class_id__dept__name')
     ordering = ('student__class_id__dept__name', 'student__class_id__id', 'student__USN')
 
 
 class StudentAdmin(admin.ModelAdmin):
     list_display = ('USN', 'name', 'class_id')
+    list_select_related = ('class_id__dept',)
     search_fields = ('USN', 'name', 'class_id__id', 'class_id__dept__name')
     ordering = ['class_id__dept__name', 'class_id__id', 'USN']
 
 
+class FreeAtFilter(admin.SimpleListFilter):
+    title = 'free at'
+    parameter_name = 'free_at'
+
+    def lookups(self, request, model_admin):
+        return [('%s|%s' % (d[0], t[0]), '%s %s' % (d[0], t[0])) for d in DAYS_OF_WEEK for t in time_slots]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            day, period = self.value().split('|')
+            return queryset.free_at(day, period)
+        return queryset
+
+
 class TeacherAdmin(admin.ModelAdmin):
     list_display = ('name', 'dept')
+    list_select_related = ('dept',)
+    list_filter = (FreeAtFilter, 'dept')
     search_fields = ('name', 'dept__name')
     ordering = ['dept__name', 'name']
 
 
 class AttendanceClassAdmin(admin.ModelAdmin):
     list_display = ('assign', 'date', 'status')
+    list_select_related = ('assign__class_id__dept', 'assign__course', 'assign__teacher')
+    readonly_fields = ('version', 'submission_key')
     ordering = ['assign', 'date']
     change_list_template = 'admin/attendance/attendance_change_list.html'
 
@@ -101,38 +144,45 @@ class AttendanceClassAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         my_urls = [
             path('reset_attd/', self.reset_attd, name='reset_attd'),
+            path('extend_attd/', self.extend_attd, name='extend_attd'),
         ]
         return my_urls + urls
 
     def reset_attd(self, request):
-
         start_date = datetime.strptime(request.POST['startdate'], '%Y-%m-%d').date()
         end_date = datetime.strptime(request.POST['enddate'], '%Y-%m-%d').date()
+        job = Job.objects.enqueue('reset_attendance', start_date=str(start_date), end_date=str(end_date))
+        self.message_user(request, "Attendance reset queued as job %d, see Jobs for its progress." % job.id)
+        return HttpResponseRedirect("../")
 
-        try:
-            a = AttendanceRange.objects.all()[:1].get()
-            a.start_date = start_date
-            a.end_date = end_date
-            a.save()
-        except AttendanceRange.DoesNotExist:
-            a = AttendanceRange(start_date=start_date, end_date=end_date)
-            a.save()
-
-        Attendance.objects.all().delete()
-        AttendanceClass.objects.all().delete()
-        for asst in AssignTime.objects.all():
-            for single_date in daterange(start_date, end_date):
-                if single_date.isoweekday() == days[asst.day]:
-                    try:
-                        AttendanceClass.objects.get(date=single_date.strftime("%Y-%m-%d"), assign=asst.assign)
-                    except AttendanceClass.DoesNotExist:
-                        a = AttendanceClass(date=single_date.strftime("%Y-%m-%d"), assign=asst.assign)
-                        a.save()
-
-        self.message_user(request, "Attendance Dates reset successfully!")
+    def extend_attd(self, request):
+        start_date = datetime.strptime(request.POST['startdate'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.POST['enddate'], '%Y-%m-%d').date()
+        job = Job.objects.enqueue('extend_attendance', start_date=str(start_date), end_date=str(end_date))
+        self.message_user(request, "Attendance extension queued as job %d, see Jobs for its progress." % job.id)
         return HttpResponseRedirect("../")
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress', 'done', 'total', 'created', 'started', 'finished', 'worker')
+    list_filter = ('status', 'kind')
+    ordering = ['-id']
+    readonly_fields = [f.name for f in Job._meta.fields]
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def requeue(self, request, queryset):
+        count = queryset.filter(status='failed').update(status='queued', done=0, total=0, message='', worker='',
+                                                        started=None, finished=None)
+        self.message_user(request, "%d failed jobs queued again." % count)
+    requeue.short_description = 'Queue failed jobs again'
+
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Dept, DeptAdmin)
 admin.site.register(Class, ClassAdmin)
@@ -142,3 +192,38 @@ admin.site.register(Teacher, TeacherAdmin)
 admin.site.register(Assign, AssignAdmin)
 admin.site.register(StudentCourse, StudentCourseAdmin)
 admin.site.register(AttendanceClass, AttendanceClassAdmin)
+admin.site.register(Job, JobAdmin)
+
+
+def request_stats(request):
+    """Timings of the latest requests per URL, recorded by the instrumentation middleware."""
+    if request.method == 'POST':
+        middleware.stats.clear()
+        return HttpResponseRedirect('.')
+    buckets = ['\u2264 %d ms' % bound for bound in middleware.RequestStats.buckets]
+    buckets.append('> %d ms' % middleware.RequestStats.buckets[-1])
+    context = dict(
+        admin.site.each_context(request),
+        title='Request timings',
+        enabled='info.middleware.InstrumentationMiddleware' in settings.MIDDLEWARE,
+        rows=middleware.stats.summary(),
+        buckets=buckets,
+    )
+    return render(request, 'admin/request_stats.html', context)
+
+
+def at_risk(request):
+    """The students short of attendance in the courses of one department, or of all of them."""
+    dept = request.GET.get('dept') or None
+    at_list = AttendanceTotal.objects.at_risk(dept)
+    if request.GET.get('format') == 'csv':
+        return exports.csv_response(exports.at_risk(at_list), 'at_risk_%s.csv' % (dept or 'all'))
+    context = dict(
+        admin.site.each_context(request),
+        title='Students short of attendance',
+        depts=Dept.objects.order_by('name'),
+        dept=dept,
+        at_list=at_list,
+        min_attendance=MIN_ATTENDANCE,
+    )
+    return render(request, 'admin/at_risk.html', context)
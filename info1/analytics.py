@@ -0,0 +1,199 @@
+"""
+Attendance analytics on a student x class matrix, computed with NumPy.
+
+AttendanceMatrix reads the attendance of one class or of a department into
+two boolean matrices, with a row per student and a column per
+AttendanceClass taken, in date order: ``taken``, whether the student has an
+Attendance row for the class, and ``present``. The rows are streamed with
+values_list, and every statistic is then computed on whole matrices at
+once, instead of row by row through AttendanceTotal.
+"""
+import numpy as np
+
+from .models import Attendance, AttendanceClass, Class, Student, StudentCourse, DAYS_OF_WEEK, MIN_ATTENDANCE
+
+
+def runs(a):
+    """
+    For each row of the boolean matrix ``a``, the length of its longest run
+    of True and of the run it ends with.
+    """
+    n = a.shape[1]
+    if n == 0:
+        zeros = np.zeros(a.shape[0], dtype=np.int32)
+        return zeros, zeros
+    index = np.arange(1, n + 1)
+    # The column after the last False up to each column, i.e. where the run through it started.
+    start = np.maximum.accumulate(np.where(a, 0, index), axis=1)
+    length = np.where(a, index - start, 0)
+    return length.max(axis=1), length[:, -1]
+
+
+def slopes(a):
+    """The least squares slope of each row of ``a`` against the column number."""
+    n = a.shape[1]
+    if n < 2:
+        return np.zeros(a.shape[0])
+    x = np.arange(n) - (n - 1) / 2
+    return (a - a.mean(axis=1, keepdims=True)) @ x / (x @ x)
+
+
+def percentages(attended, total):
+    return np.where(total > 0, np.round(100 * attended / np.maximum(total, 1), 2), 0)
+
+
+def classes_to_attend(attended, total):
+    """AttendanceTotal.set_counts() on whole arrays."""
+    return np.maximum(-((100 * attended - MIN_ATTENDANCE * total) // (100 - MIN_ATTENDANCE)), 0)
+
+
+class AttendanceMatrix:
+
+    def __init__(self, students, student_classes, columns, taken, present):
+        self.students = students
+        self.student_classes = student_classes
+        self.ids, self.dates, self.assigns, self.courses, self.classes = columns
+        self.taken = taken
+        self.present = present
+
+    @classmethod
+    def for_class(cls, class_id):
+        return cls.load([class_id])
+
+    @classmethod
+    def for_dept(cls, dept_id):
+        return cls.load(Class.objects.filter(dept=dept_id).values_list('id', flat=True))
+
+    @classmethod
+    def load(cls, class_ids):
+        """The matrix of the students of the given classes and of the classes taken of their assigns."""
+        class_ids = list(class_ids)
+        studs = list(Student.objects.filter(class_id__in=class_ids).order_by('USN').values_list('USN', 'class_id'))
+        cols = list(AttendanceClass.objects.filter(status=1, assign__class_id__in=class_ids).order_by('date', 'id')
+                    .values_list('id', 'date', 'assign_id', 'assign__course_id', 'assign__class_id'))
+        rows = {usn: i for i, (usn, _) in enumerate(studs)}
+        columns = {assc_id: j for j, (assc_id, *_) in enumerate(cols)}
+
+        r, c, status = [], [], []
+        for usn, assc_id, present in Attendance.objects \
+                .filter(attendanceclass__status=1, attendanceclass__assign__class_id__in=class_ids) \
+                .values_list('student_id', 'attendanceclass_id', 'status').iterator(chunk_size=5000):
+            if usn in rows:
+                r.append(rows[usn])
+                c.append(columns[assc_id])
+                status.append(present)
+        taken = np.zeros((len(studs), len(cols)), dtype=bool)
+        present = np.zeros_like(taken)
+        taken[r, c] = True
+        present[r, c] = status
+
+        return cls(
+            np.array([usn for usn, _ in studs], dtype=object),
+            np.array([class_id for _, class_id in studs], dtype=object),
+            (np.array([col[0] for col in cols], dtype=np.int64),
+             np.array([col[1] for col in cols], dtype='datetime64[D]'),
+             np.array([col[2] for col in cols], dtype=np.int64),
+             np.array([col[3] for col in cols], dtype=object),
+             np.array([col[4] for col in cols], dtype=object)),
+            taken, present)
+
+    @property
+    def absent(self):
+        return self.taken & ~self.present
+
+    def totals(self):
+        """The course ids, and the classes attended and taken by each student in each of them."""
+        courses = np.unique(self.courses)
+        # One column per course, marking the classes of that course.
+        of_course = (self.courses[:, None] == courses[None, :]).astype(np.int32)
+        return courses, self.present.astype(np.int32) @ of_course, self.taken.astype(np.int32) @ of_course
+
+    def assign_blocks(self, courses):
+        """For each assign: the course number, and the rows of its students and the columns of its classes."""
+        for assign_id in np.unique(self.assigns):
+            cols = self.assigns == assign_id
+            class_id = self.classes[cols][0]
+            yield np.searchsorted(courses, self.courses[cols][0]), self.student_classes == class_id, cols
+
+    def semester(self):
+        """
+        The attendance of every student in every course with classes taken:
+        the counters of AttendanceTotal, with ``longest_absence`` and
+        ``current_absence``, the longest and the latest run of classes
+        missed in a row, and ``trend``, the change of attendance per class
+        over the semester in percentage points.
+        """
+        courses, attended, total = self.totals()
+        longest = np.zeros_like(total)
+        current = np.zeros_like(total)
+        trend = np.zeros(total.shape)
+        absent = self.absent
+        for k, rows, cols in self.assign_blocks(courses):
+            block = np.ix_(rows, cols)
+            longest[rows, k], current[rows, k] = runs(absent[block])
+            trend[rows, k] = np.round(100 * slopes(self.present[block].astype(float)), 2)
+
+        pct = percentages(attended, total)
+        cta = classes_to_attend(attended, total)
+        shortage = 100 * attended < MIN_ATTENDANCE * total
+        return [{
+            'student': self.students[i],
+            'course': courses[k],
+            'att_class': int(attended[i, k]),
+            'total_class': int(total[i, k]),
+            'attendance': float(pct[i, k]),
+            'classes_to_attend': int(cta[i, k]),
+            'shortage': bool(shortage[i, k]),
+            'longest_absence': int(longest[i, k]),
+            'current_absence': int(current[i, k]),
+            'trend': float(trend[i, k]),
+        } for i, k in zip(*np.nonzero(total))]
+
+    def weekday_absence(self):
+        """The % of the students absent from the classes of each day of the week that had any."""
+        # Day 0 of datetime64 was a Thursday; this counts days from Monday.
+        weekday = (self.dates.astype(np.int64) + 3) % 7
+        absent = np.bincount(weekday, weights=self.absent.sum(axis=0), minlength=7)
+        taken = np.bincount(weekday, weights=self.taken.sum(axis=0), minlength=7)
+        return {DAYS_OF_WEEK[d][0]: round(100 * absent[d] / taken[d], 2)
+                for d in range(len(DAYS_OF_WEEK)) if taken[d]}
+
+    def weekly_attendance(self):
+        """For each class, the % attendance of each week with classes, as (Monday of the week, %) pairs."""
+        week = (self.dates.astype(np.int64) + 3) // 7
+        first = week.min() if len(week) else 0
+        result = {}
+        for class_id in np.unique(self.student_classes):
+            rows = self.student_classes == class_id
+            present = np.bincount(week - first, weights=self.present[rows].sum(axis=0))
+            taken = np.bincount(week - first, weights=self.taken[rows].sum(axis=0))
+            weeks = np.nonzero(taken)[0]
+            mondays = ((weeks + first) * 7 - 3).astype('datetime64[D]')
+            result[class_id] = [(monday.item(), round(100 * present[w] / taken[w], 2))
+                                for monday, w in zip(mondays, weeks)]
+        return result
+
+    def marks_correlation(self):
+        """
+        For each course, the correlation between the attendance % and the
+        CIE of its students, or None if either is the same for all of them.
+        """
+        courses, attended, total = self.totals()
+        cie = np.zeros(total.shape)
+        rows = {usn: i for i, usn in enumerate(self.students)}
+        # By class rather than by student, which would bind a parameter per student of the department.
+        for usn, course_id, value in StudentCourse.objects \
+                .filter(student__class_id__in=np.unique(self.student_classes).tolist(), course__in=courses.tolist()) \
+                .with_cie().values_list('student_id', 'course_id', 'cie'):
+            if usn in rows:
+                cie[rows[usn], np.searchsorted(courses, course_id)] = value or 0
+        pct = percentages(attended, total)
+        result = {}
+        for k, course_id in enumerate(courses):
+            mask = total[:, k] > 0
+            x, y = pct[mask, k], cie[mask, k]
+            if len(x) > 1 and x.std() > 0 and y.std() > 0:
+                result[course_id] = round(float(np.corrcoef(x, y)[0, 1]), 3)
+            else:
+                result[course_id] = None
+        return result
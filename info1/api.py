@@ -0,0 +1,196 @@
+"""
+Version 1 of the JSON API, for the teacher app.
+
+Each endpoint takes a whole roll call or marks sheet as one JSON object,
+checks every entry before writing anything, writes it in one transaction
+and answers with the updated aggregates of the class. Errors are answered
+as {"error": message, "details": {...}} with a 4xx status.
+
+Roll calls may be sent with an Idempotency-Key header, any string of up to
+64 characters unique to the submission: a retry with the same key is
+answered without recording anything again. They may also give the
+``version`` of the class they were made from, as answered by the previous
+submission; if the class has changed since, nothing is recorded and the
+answer is 409 with the current version.
+
+The views are async: the request body is read and parsed without holding a
+thread, and the database work runs in one sync_to_async call. Clients log
+in through /accounts/login/ and send the session cookie. Requests must be
+sent as application/json, which browsers cannot do cross-site without a
+CORS preflight, so the views do not need CSRF tokens.
+"""
+import json
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path
+
+from .models import Assign, AttendanceClass, AttendanceConflict, AttendanceTotal, MarksClass, Student, StudentCourse
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details
+
+
+def api_view(handler):
+    """
+    Turn ``handler(request, payload, **kwargs)``, a synchronous function
+    returning the response data, into an async JSON POST view.
+    """
+    @wraps(handler)
+    async def view(request, **kwargs):
+        try:
+            if request.method != 'POST':
+                raise ApiError(405, 'Use POST')
+            if request.content_type != 'application/json':
+                raise ApiError(415, 'Send the payload as application/json')
+            try:
+                payload = json.loads(request.body)
+            except ValueError:
+                raise ApiError(400, 'The payload is not valid JSON')
+            if not isinstance(payload, dict):
+                raise ApiError(400, 'The payload must be a JSON object')
+            return JsonResponse(await sync_to_async(handler)(request, payload, **kwargs))
+        except Http404:
+            return JsonResponse({'error': 'Not found'}, status=404)
+        except ApiError as e:
+            body = {'error': e.message}
+            if e.details:
+                body['details'] = e.details
+            return JsonResponse(body, status=e.status)
+
+    view.csrf_exempt = True
+    return view
+
+
+def check_teacher(user, ass):
+    """Only the teacher of an assign, or staff, may submit for it."""
+    if not user.is_authenticated:
+        raise ApiError(401, 'Log in first')
+    if not user.is_staff and (not user.is_teacher or user.teacher.id != ass.teacher_id):
+        raise ApiError(403, 'Only the teacher of this class may submit for it')
+
+
+def check_roll(payload, ass):
+    """The roll of the payload as a dict of USN to bool, complete for the class of ``ass``."""
+    roll = payload.get('roll')
+    if not isinstance(roll, dict):
+        raise ApiError(400, 'roll must be an object of USN to true (present) or false (absent)')
+    usns = set(Student.objects.filter(class_id_id=ass.class_id_id).values_list('USN', flat=True))
+    details = {}
+    for usn, status in roll.items():
+        if usn not in usns:
+            details[usn] = 'not a student of %s' % ass.class_id_id
+        elif not isinstance(status, bool):
+            details[usn] = 'must be true or false'
+    for usn in usns.difference(roll):
+        details[usn] = 'missing'
+    if details:
+        raise ApiError(400, 'Invalid roll', details)
+    return roll
+
+
+def check_submission(request, payload):
+    """The idempotency key and the expected version of the class, if given."""
+    key = request.headers.get('Idempotency-Key', '')
+    if len(key) > 64:
+        raise ApiError(400, 'Idempotency-Key must be at most 64 characters')
+    version = payload.get('version')
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        raise ApiError(400, 'version must be a whole number')
+    return key, version
+
+
+def attendance_summary(assc, roll):
+    totals = AttendanceTotal.objects.fetch(sorted(roll), [assc.assign.course_id])
+    return {
+        'attendanceclass': assc.id,
+        'date': str(assc.date),
+        'status': assc.status,
+        'version': assc.version,
+        'present': sum(roll.values()),
+        'absent': len(roll) - sum(roll.values()),
+        'students': [{'usn': t.student_id, 'attended': t.att_class, 'total': t.total_class,
+                      'attendance': t.attendance, 'classes_to_attend': t.classes_to_attend} for t in totals],
+    }
+
+
+@api_view
+def submit_attendance(request, payload, ass_c_id):
+    """Take or correct the roll call of a timetabled class."""
+    assc = get_object_or_404(AttendanceClass.objects.select_related('assign'), id=ass_c_id)
+    check_teacher(request.user, assc.assign)
+    roll = check_roll(payload, assc.assign)
+    key, version = check_submission(request, payload)
+    with transaction.atomic():
+        try:
+            assc.submit(roll, key, version)
+        except AttendanceConflict as e:
+            raise ApiError(409, 'The attendance was changed since this version', {'version': e.assc.version})
+        return attendance_summary(assc, roll)
+
+
+@api_view
+def submit_extra_class(request, payload, assign_id):
+    """Add a class outside the timetable, with its roll call."""
+    ass = get_object_or_404(Assign, id=assign_id)
+    check_teacher(request.user, ass)
+    try:
+        class_date = date.fromisoformat(payload.get('date'))
+    except (TypeError, ValueError):
+        raise ApiError(400, 'date must be given as YYYY-MM-DD')
+    roll = check_roll(payload, ass)
+    key, _ = check_submission(request, payload)
+    with transaction.atomic():
+        assc, _ = AttendanceClass.objects.take_extra(ass, class_date, roll, key)
+        return attendance_summary(assc, roll)
+
+
+@api_view
+def submit_marks(request, payload, marks_c_id):
+    """Enter or correct the marks of a test."""
+    mc = get_object_or_404(MarksClass.objects.select_related('assign'), id=marks_c_id)
+    ass = mc.assign
+    check_teacher(request.user, ass)
+    marks = payload.get('marks')
+    if not isinstance(marks, dict):
+        raise ApiError(400, 'marks must be an object of USN to marks scored')
+    usns = set(Student.objects.filter(class_id_id=ass.class_id_id).values_list('USN', flat=True))
+    details = {}
+    for usn, mark in marks.items():
+        if usn not in usns:
+            details[usn] = 'not a student of %s' % ass.class_id_id
+        elif not isinstance(mark, int) or isinstance(mark, bool) or not 0 <= mark <= mc.total_marks:
+            details[usn] = 'must be a whole number from 0 to %d' % mc.total_marks
+    for usn in usns.difference(marks):
+        details[usn] = 'missing'
+    if details:
+        raise ApiError(400, 'Invalid marks', details)
+
+    with transaction.atomic():
+        mc.submit(marks)
+        sc_list = StudentCourse.objects.filter(student__class_id=ass.class_id_id, course=ass.course_id) \
+            .with_cie().order_by('student_id')
+        return {
+            'marksclass': mc.id,
+            'name': mc.name,
+            'status': mc.status,
+            'average': round(sum(marks.values()) / len(marks), 2) if marks else 0,
+            'students': [{'usn': sc.student_id, 'marks': marks[sc.student_id], 'cie': sc.get_cie()}
+                         for sc in sc_list],
+        }
+
+
+urlpatterns = [
+    path('attendance/<int:ass_c_id>/', submit_attendance, name='api_attendance'),
+    path('assign/<int:assign_id>/extra_class/', submit_extra_class, name='api_extra_class'),
+    path('marks/<int:marks_c_id>/', submit_marks, name='api_marks'),
+]
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from .db import configure_sqlite
 
 
 class InfoConfig(AppConfig):
     name = 'info'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,17 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .models import User
+
+
+class RoleModelBackend(ModelBackend):
+    """
+    Load the user together with its Student or Teacher profile, so that
+    is_student, is_teacher and the profile itself need no further queries.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = User.objects.select_related('student', 'teacher').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,59 @@
+"""
+Read-through caching of ERP pages and aggregates.
+
+A cached value is stored under a key built from the current versions of the
+objects it was computed from, e.g. ('class', 'CS5A') or ('student', 'CS01').
+Writes bump those versions instead of deleting keys, so entries computed from
+old data are never read again and simply expire.
+"""
+from uuid import uuid4
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+def is_shared():
+    """Whether versions bumped in this process are seen by the others, i.e. the cache is not locmem."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def _version_key(kind, pk):
+    return 'erp:version:%s:%s' % (kind, pk)
+
+
+def _set_versions(keys):
+    cache.set_many({k: uuid4().hex for k in keys}, None)
+
+
+def bump(kind, *pks):
+    """
+    Invalidate everything cached for the given objects of one kind. The
+    versions change at once and again when the current transaction commits,
+    so nothing computed from uncommitted data outlives it.
+    """
+    if pks:
+        keys = [_version_key(kind, pk) for pk in pks]
+        _set_versions(keys)
+        transaction.on_commit(lambda: _set_versions(keys))
+
+
+def cached(name, depends, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the value cached under ``name`` for the current versions of
+    ``depends``, a list of (kind, pk) pairs, calling ``compute`` on a miss.
+    """
+    keys = [_version_key(kind, pk) for kind, pk in depends]
+    versions = cache.get_many(keys)
+    missing = {k: uuid4().hex for k in keys if k not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    key = 'erp:%s:%s' % (name, ':'.join(versions[k] for k in keys))
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,112 @@
+"""
+Server-side processing for DataTables (https://datatables.net/manual/server-side).
+
+A Table pages, sorts and searches a queryset with the parameters DataTables
+sends in server-side mode. The page views render the first page with the
+HTML; the table's JSON endpoint serves the others. Moving on to the next
+page passes the ``after`` cursor of the last row shown, so that it is read
+with keyset pagination on the table's key (e.g. date, id) rather than an
+OFFSET growing with the page number. Jumping to an arbitrary page, or
+sorting on another column, falls back to OFFSET.
+"""
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.html import conditional_escape
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class Table:
+    """
+    ``columns`` gives for each column of the table the field it sorts on, or
+    None if it is not sortable. ``key`` are the fields of the default sort,
+    the last one unique. ``search`` are the fields the search box matches,
+    by prefix. ``cells`` turns a row and its number in the list into the
+    cells of the row.
+    """
+
+    def __init__(self, columns, cells, key=('date', 'id'), descending=False, search=()):
+        self.columns = columns
+        self.cells = cells
+        self.key = key
+        self.descending = descending
+        self.search = search
+
+    def ordering(self, params):
+        """The field to sort on and whether descending, from the request or the default."""
+        try:
+            field = self.columns[int(params.get('order[0][column]'))]
+        except (TypeError, ValueError, IndexError):
+            field = None
+        if field is None:
+            return self.key[0], self.descending
+        return field, params.get('order[0][dir]') == 'desc'
+
+    def order_by(self, field, descending):
+        fields = [field] + [k for k in self.key if k != field]
+        return ['-' + f if descending else f for f in fields]
+
+    def render(self, rows, start=1):
+        """The cells of ``rows`` as HTML, DataTables inserts them as such."""
+        return [[conditional_escape(cell) for cell in self.cells(row, n)] for n, row in enumerate(rows, start=start)]
+
+    def cursor(self, row):
+        return ','.join(str(getattr(row, f)) for f in self.key)
+
+    def seek(self, cursor, descending):
+        """The rows after ``cursor`` in key order."""
+        values = cursor.split(',', len(self.key) - 1)
+        op = '__lt' if descending else '__gt'
+        q = Q()
+        for i, field in enumerate(self.key):
+            q |= Q(**dict(zip(self.key[:i], values), **{field + op: values[i]}))
+        return q
+
+    def first_page(self, queryset):
+        """The context of a page view: the first page of rows, as DataTables will show it."""
+        rows = list(queryset.order_by(*self.order_by(self.key[0], self.descending))[:PAGE_SIZE])
+        return {
+            'object_list': rows,
+            'rows': self.render(rows),
+            'total': queryset.count(),
+            'next': self.cursor(rows[-1]) if rows else '',
+            'page_size': PAGE_SIZE,
+        }
+
+    def response(self, request, queryset):
+        """The JSON response to a DataTables server-side request."""
+        params = request.GET
+        try:
+            draw = int(params.get('draw', 0))
+            start = max(int(params.get('start', 0)), 0)
+            length = int(params.get('length', PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid paging parameters'}, status=400)
+        if not 0 < length <= MAX_PAGE_SIZE:
+            length = MAX_PAGE_SIZE
+
+        total = filtered = queryset.count()
+        search = params.get('search[value]', '').strip()
+        if search and self.search:
+            q = Q()
+            for field in self.search:
+                q |= Q(**{field + '__istartswith': search})
+            queryset = queryset.filter(q)
+            filtered = queryset.count()
+
+        field, descending = self.ordering(params)
+        queryset = queryset.order_by(*self.order_by(field, descending))
+        after = params.get('after')
+        if after and field == self.key[0]:
+            rows = list(queryset.filter(self.seek(after, descending))[:length])
+        else:
+            rows = list(queryset[start:start + length])
+
+        return JsonResponse({
+            'draw': draw,
+            'recordsTotal': total,
+            'recordsFiltered': filtered,
+            'data': self.render(rows, start + 1),
+            'next': self.cursor(rows[-1]) if len(rows) == length else None,
+        })
@@ -0,0 +1,11 @@
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Put every new SQLite connection in write-ahead logging mode, in which
+    readers do not block the writer nor the writer the readers, so only
+    writes still queue on the database lock.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            # Safe with WAL, and saves an fsync on every commit.
+            cursor.execute('PRAGMA synchronous=NORMAL')
@@ -0,0 +1,81 @@
+import csv
+from itertools import groupby
+
+from django.http import StreamingHttpResponse
+
+from .models import Attendance, AttendanceTotal, Marks, StudentCourse, test_name
+
+
+class Echo:
+    """An object that implements just the write method of the file-like interface."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(rows, filename):
+    """Stream ``rows`` as a CSV download, encoding one row at a time."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+def attendance_register(ass):
+    """
+    Rows of the attendance register of an Assign: one column per class taken
+    and one row per student, marked P or A.
+    """
+    assc_list = list(ass.attendanceclass_set.filter(status=1).order_by('date', 'id').values_list('id', 'date'))
+    yield ['USN', 'Student name'] + [str(date) for _, date in assc_list]
+
+    columns = {assc_id: i for i, (assc_id, _) in enumerate(assc_list)}
+    att_list = Attendance.objects.filter(attendanceclass__assign=ass, attendanceclass__status=1) \
+        .order_by('student_id').values_list('student_id', 'student__name', 'attendanceclass_id', 'status')
+    for (usn, name), rows in groupby(att_list.iterator(), key=lambda a: a[:2]):
+        cells = [''] * len(columns)
+        for _, _, assc_id, status in rows:
+            cells[columns[assc_id]] = 'P' if status else 'A'
+        yield [usn, name] + cells
+
+
+def marks_sheet(ass):
+    """Rows of the marks sheet of an Assign: one row per student, one column per test."""
+    yield ['USN', 'Student name'] + [name[0] for name in test_name]
+
+    columns = {name[0]: i for i, name in enumerate(test_name)}
+    m_list = Marks.objects.filter(studentcourse__course=ass.course_id,
+                                  studentcourse__student__class_id=ass.class_id_id) \
+        .order_by('studentcourse__student_id') \
+        .values_list('studentcourse__student_id', 'studentcourse__student__name', 'name', 'marks1')
+    for (usn, name), rows in groupby(m_list.iterator(), key=lambda m: m[:2]):
+        cells = [''] * len(columns)
+        for _, _, test, marks1 in rows:
+            cells[columns[test]] = marks1
+        yield [usn, name] + cells
+
+
+def dept_report(dept_ids):
+    """
+    Rows of the report of the given departments: attendance and CIE of every
+    student in every course of their class.
+    """
+    yield ['Department', 'Class', 'USN', 'Student name', 'Course ID', 'Course name', 'Attended classes',
+           'Total classes', 'Attendance %', 'CIE']
+
+    sc_list = StudentCourse.objects.filter(student__class_id__dept__in=dept_ids).with_cie().with_attendance() \
+        .order_by('student__class_id__dept__name', 'student__class_id_id', 'student_id', 'course_id') \
+        .values_list('student__class_id__dept__name', 'student__class_id_id', 'student_id', 'student__name',
+                     'course_id', 'course__name', 'att_class', 'total_class', 'cie')
+    for dept, class_id, usn, name, course_id, course, att_class, total_class, cie in sc_list.iterator():
+        a = AttendanceTotal(att_class=att_class or 0, total_class=total_class or 0)
+        yield [dept, class_id, usn, name, course_id, course, a.att_class, a.total_class, a.attendance, cie]
+
+
+def at_risk(at_list):
+    """Rows of the students short of attendance, from an AttendanceTotal.objects.at_risk() queryset."""
+    yield ['Department', 'Class', 'USN', 'Student name', 'Course ID', 'Course name', 'Attended classes',
+           'Total classes', 'Attendance %', 'Classes to attend', 'Short since']
+    for a in at_list.iterator():
+        yield [a.course.dept_id, a.student.class_id_id, a.student_id, a.student.name, a.course_id, a.course.name,
+               a.att_class, a.total_class, a.attendance, a.classes_to_attend, a.shortage_since]
@@ -0,0 +1,195 @@
+"""
+Handlers of the background jobs queued in the Job table by the admin, run by
+``manage.py worker``.
+
+A handler works through its rows in chunks, commits each chunk in its own
+transaction and reports its progress after each one, so that no transaction
+holds the whole table and the admin can follow along. A job that stopped
+half way, e.g. with its worker, can simply be run again: every handler
+carries on from the state the last committed chunk left.
+
+Rows written in bulk send no signals, so every handler bumps the cached
+versions of the classes and courses it touched after each chunk. The
+worker is a process of its own, so this only reaches the web processes
+through a cache they share, which the worker checks before starting.
+
+Jobs are run in the order they were queued. With more than one worker
+process, jobs queued one after the other may run at the same time, e.g. an
+extension of the calendar while it is being reset.
+"""
+import logging
+import time
+import traceback
+from datetime import date
+
+from django.db import OperationalError, connection, transaction
+
+from . import caching
+from .models import Assign, AssignTime, Attendance, AttendanceClass, AttendanceRange, AttendanceTotal, Class, \
+    Course, Job, MarksClass, Student, StudentCourse
+
+logger = logging.getLogger('info.jobs')
+
+# Rows deleted per transaction.
+CHUNK_SIZE = 1000
+# Assigns handled per transaction; each one fans out to a class worth of rows.
+ASSIGN_CHUNK_SIZE = 50
+# Attempts at a chunk that SQLite refuses because another process is writing.
+ATTEMPTS = 5
+
+
+def in_chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def commit(work):
+    """
+    Run ``work`` in a transaction and return its result. SQLite fails a
+    transaction that reads and then writes when another process wrote in
+    between, instead of waiting for it; every chunk can be done again, so
+    it is retried a few times.
+    """
+    for attempt in range(ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return work()
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == ATTEMPTS - 1 or connection.in_atomic_block:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def invalidate(pairs):
+    """Bump the cached versions of the classes and courses of the (class, course) pairs."""
+    caching.bump('class', *{class_id for class_id, _ in pairs})
+    caching.bump('course', *{course_id for _, course_id in pairs})
+
+
+def set_range(start_date, end_date, extend=False):
+    """Set the AttendanceRange, or with ``extend`` widen it to cover the dates. Returns it."""
+    def work():
+        r = AttendanceRange.objects.select_for_update().first()
+        if r is None:
+            return AttendanceRange.objects.create(start_date=start_date, end_date=end_date)
+        if extend:
+            r.start_date, r.end_date = min(r.start_date, start_date), max(r.end_date, end_date)
+        else:
+            r.start_date, r.end_date = start_date, end_date
+        r.save()
+        return r
+    return commit(work)
+
+
+def delete_classes(job):
+    """
+    Delete every AttendanceClass with its roll call, CHUNK_SIZE classes per
+    transaction. The rows are deleted in SQL, without the post_delete
+    handlers, which would bump the cache and recount the totals row by row;
+    the caller resets both once at the end.
+    """
+    def work():
+        ids = list(AttendanceClass.objects.order_by('id').values_list('id', flat=True)[:CHUNK_SIZE])
+        deleted = Attendance.objects.filter(attendanceclass__in=ids)._raw_delete(connection.alias)
+        return deleted + AttendanceClass.objects.filter(id__in=ids)._raw_delete(connection.alias)
+
+    while True:
+        deleted = commit(work)
+        if not deleted:
+            return
+        job.advance(deleted)
+
+
+def generate_classes(job, start_date, end_date):
+    """Create the missing AttendanceClasses of the range, a chunk of assigns at a time."""
+    def work(chunk):
+        created = AttendanceClass.objects.generate(start_date, end_date, AssignTime.objects.filter(assign__in=chunk))
+        invalidate(list(Assign.objects.filter(id__in=chunk).values_list('class_id', 'course_id')))
+        return created
+
+    created = 0
+    for chunk in in_chunks(Assign.objects.order_by('id').values_list('id', flat=True), ASSIGN_CHUNK_SIZE):
+        created += commit(lambda: work(chunk))
+        job.advance(len(chunk))
+    return created
+
+
+def reset_attendance(job, start_date, end_date):
+    """Delete all attendance and regenerate the calendar for the new range."""
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    set_range(start_date, end_date)
+    job.advance(0, Attendance.objects.count() + AttendanceClass.objects.count() + Assign.objects.count())
+    delete_classes(job)
+
+    def work():
+        AttendanceTotal.objects.update(att_class=0, total_class=0, classes_to_attend=0, shortage=False,
+                                       shortage_since=None)
+        # Every page of a student or an assign depends on its class.
+        caching.bump('class', *Class.objects.values_list('id', flat=True))
+        caching.bump('course', *Course.objects.values_list('id', flat=True))
+
+    commit(work)
+    return '%d classes from %s to %s' % (generate_classes(job, start_date, end_date), start_date, end_date)
+
+
+def extend_attendance(job, start_date, end_date):
+    """Widen the range to the dates and add the classes it is missing, keeping all attendance."""
+    r = set_range(date.fromisoformat(start_date), date.fromisoformat(end_date), extend=True)
+    job.advance(0, Assign.objects.count())
+    return '%d classes added' % generate_classes(job, r.start_date, r.end_date)
+
+
+def provision_assigns(job, ids):
+    """Create the missing MarksClass, StudentCourse and Marks rows of the assigns."""
+    job.advance(0, len(ids))
+    created = 0
+
+    def work(chunk):
+        assigns = list(Assign.objects.filter(id__in=chunk))
+        MarksClass.objects.provision(assigns)
+        return StudentCourse.objects.provision(assigns=assigns)
+
+    for chunk in in_chunks(ids, ASSIGN_CHUNK_SIZE):
+        created += commit(lambda: work(chunk))
+        job.advance(len(chunk))
+    return '%d student courses created' % created
+
+
+def delete_assigns(job, ids):
+    """Delete the assigns with their classes, attendance and marks, and recount the attendance of their students."""
+    job.advance(0, len(ids))
+
+    def work(chunk):
+        pairs = list(Assign.objects.filter(id__in=chunk).values_list('class_id', 'course_id'))
+        Assign.objects.filter(id__in=chunk).delete()
+        for class_id, course_id in pairs:
+            students = Student.objects.filter(class_id=class_id).values_list('USN', flat=True)
+            AttendanceTotal.objects.refresh(students, [course_id])
+        invalidate(pairs)
+
+    for chunk in in_chunks(ids, ASSIGN_CHUNK_SIZE):
+        commit(lambda: work(chunk))
+        job.advance(len(chunk))
+    return '%d assigns deleted' % len(ids)
+
+
+HANDLERS = {
+    'reset_attendance': reset_attendance,
+    'extend_attendance': extend_attendance,
+    'provision_assigns': provision_assigns,
+    'delete_assigns': delete_assigns,
+}
+
+
+def run(job_id):
+    """Run a claimed job to its end and record how it ended. Returns its status."""
+    job = Job.objects.get(id=job_id)
+    try:
+        message = HANDLERS[job.kind](job, **job.args)
+    except Exception:
+        logger.exception('Job %s failed', job)
+        job.finish('failed', traceback.format_exc())
+    else:
+        job.finish('done', message)
+    return job.status
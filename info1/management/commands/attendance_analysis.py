@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from info.analytics import AttendanceMatrix
+
+
+class Command(BaseCommand):
+    help = ('Analyse the attendance of a department or a class over the semester: absence by day of the week, '
+            'weekly attendance per class, correlation with CIE and the longest runs of absences.')
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--dept', help='Department id')
+        group.add_argument('--class', dest='class_id', help='Class id')
+        parser.add_argument('--top', type=int, default=10, help='Students listed with the longest runs of absences')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['dept']:
+            m = AttendanceMatrix.for_dept(options['dept'])
+        else:
+            m = AttendanceMatrix.for_class(options['class_id'])
+        loaded = time.perf_counter()
+        semester = m.semester()
+        weekdays = m.weekday_absence()
+        weeks = m.weekly_attendance()
+        correlation = m.marks_correlation()
+        done = time.perf_counter()
+
+        self.stdout.write('%d students x %d classes, loaded in %.0f ms, analysed in %.0f ms' % (
+            m.taken.shape[0], m.taken.shape[1], (loaded - start) * 1000, (done - loaded) * 1000))
+        self.stdout.write('\nAbsent by day of the week:')
+        for day, pct in weekdays.items():
+            self.stdout.write('  %-10s %6.2f%%' % (day, pct))
+        self.stdout.write('\nAttendance by week:')
+        for class_id, rows in weeks.items():
+            self.stdout.write('  %s: %s' % (class_id, ' '.join('%.0f' % pct for _, pct in rows)))
+        self.stdout.write('\nCorrelation of attendance with CIE:')
+        for course_id, r in correlation.items():
+            self.stdout.write('  %-10s %s' % (course_id, '-' if r is None else '%.3f' % r))
+        self.stdout.write('\nShort of attendance: %d of %d' % (sum(s['shortage'] for s in semester), len(semester)))
+        self.stdout.write('\nLongest runs of absences:')
+        for s in sorted(semester, key=lambda s: (-s['longest_absence'], s['student']))[:options['top']]:
+            self.stdout.write('  %-12s %-10s %2d in a row, %2d now, %6.2f%%, trend %+.2f' % (
+                s['student'], s['course'], s['longest_absence'], s['current_absence'], s['attendance'], s['trend']))
@@ -0,0 +1,283 @@
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+
+from info import synthetic, urls
+from info.models import User, Student, Assign, Attendance, AttendanceRange, MarksClass
+
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'erp-benchmark'}}
+
+
+class Case:
+    """
+    One request to benchmark. ``request`` is called with the number of the
+    run and returns the path and the POST data, or None for a GET, so that
+    writes can target a different row on every run.
+    """
+
+    def __init__(self, name, role, request, repeat=True):
+        self.name = name
+        self.url_name = name.split(' ')[0]
+        self.role = role
+        self.request = request
+        self.repeat = repeat
+
+
+def fixed(path, data=None):
+    return lambda i: (path, data)
+
+
+def build_cases():
+    """The benchmarked requests, against rows picked from the synthetic data."""
+    stud = Student.objects.order_by('USN').first()
+    ass = Assign.objects.filter(class_id=stud.class_id_id).select_related('teacher').order_by('id').first()
+    assc_list = list(ass.attendanceclass_set.order_by('date', 'id').values_list('id', flat=True))
+    att = Attendance.objects.filter(student=stud, course=ass.course_id).order_by('id').first()
+    mc = MarksClass.objects.filter(assign=ass).order_by('id').first()
+    asst = ass.assigntime_set.order_by('id').first()
+    usns = list(Student.objects.filter(class_id=stud.class_id_id).order_by('USN').values_list('USN', flat=True))
+    r = AttendanceRange.objects.get()
+
+    def roll(i):
+        # Flip one student per run, so that every submit changes a row.
+        return {usn: 'absent' if n == i % len(usns) else 'present' for n, usn in enumerate(usns)}
+
+    def marks(i):
+        return {usn: str((n + i) % 20) for n, usn in enumerate(usns)}
+
+    def e_confirm(i):
+        data = roll(i)
+        data['date'] = str(r.end_date)
+        return reverse('e_confirm', args=(ass.id,)), data
+
+    return [
+        Case('index (student)', 'student', fixed(reverse('index'))),
+        Case('index (teacher)', 'teacher', fixed(reverse('index'))),
+        Case('attendance', 'student', fixed(reverse('attendance', args=(stud.USN,)))),
+        Case('student_summary', 'student', fixed(reverse('student_summary', args=(stud.USN,)))),
+        Case('attendance_detail', 'student', fixed(reverse('attendance_detail', args=(stud.USN, ass.course_id)))),
+        Case('attendance_detail_data', 'student',
+             fixed(reverse('attendance_detail_data', args=(stud.USN, ass.course_id)) + '?start=25&length=25')),
+        Case('timetable', 'student', fixed(reverse('timetable', args=(stud.class_id_id,)))),
+        Case('marks_list', 'student', fixed(reverse('marks_list', args=(stud.USN,)))),
+        Case('t_clas', 'teacher', fixed(reverse('t_clas', args=(ass.teacher_id, 1)))),
+        Case('t_student', 'teacher', fixed(reverse('t_student', args=(ass.id,)))),
+        Case('t_class_date', 'teacher', fixed(reverse('t_class_date', args=(ass.id,)))),
+        Case('t_class_date_data', 'teacher',
+             fixed(reverse('t_class_date_data', args=(ass.id,)) + '?start=25&length=25')),
+        Case('t_attendance', 'teacher', fixed(reverse('t_attendance', args=(assc_list[0],)))),
+        Case('edit_att', 'teacher', fixed(reverse('edit_att', args=(assc_list[0],)))),
+        Case('confirm', 'teacher', lambda i: (reverse('confirm', args=(assc_list[0],)), roll(i))),
+        Case('t_attendance_detail', 'teacher',
+             fixed(reverse('t_attendance_detail', args=(stud.USN, ass.course_id)))),
+        Case('t_attendance_detail_data', 'teacher',
+             fixed(reverse('t_attendance_detail_data', args=(stud.USN, ass.course_id)) + '?start=25&length=25')),
+        Case('change_att', 'teacher', fixed(reverse('change_att', args=(att.id,)))),
+        Case('t_extra_class', 'teacher', fixed(reverse('t_extra_class', args=(ass.id,)))),
+        Case('e_confirm', 'teacher', e_confirm),
+        Case('t_report', 'teacher', fixed(reverse('t_report', args=(ass.id,)))),
+        Case('export_attendance', 'teacher', fixed(reverse('export_attendance', args=(ass.id,)))),
+        Case('export_marks', 'teacher', fixed(reverse('export_marks', args=(ass.id,)))),
+        Case('export_dept_report', 'teacher', fixed(reverse('export_dept_report', args=(stud.class_id.dept_id,)))),
+        Case('t_timetable', 'teacher', fixed(reverse('t_timetable', args=(ass.teacher_id,)))),
+        Case('free_teachers', 'teacher', fixed(reverse('free_teachers', args=(asst.id,)))),
+        Case('t_marks_list', 'teacher', fixed(reverse('t_marks_list', args=(ass.id,)))),
+        Case('t_student_marks', 'teacher', fixed(reverse('t_student_marks', args=(ass.id,)))),
+        Case('t_student_marks_data', 'teacher',
+             fixed(reverse('t_student_marks_data', args=(ass.id,)) + '?start=25&length=25&search[value]=' + stud.USN)),
+        Case('t_marks_entry', 'teacher', fixed(reverse('t_marks_entry', args=(mc.id,)))),
+        Case('marks_confirm', 'teacher', lambda i: (reverse('marks_confirm', args=(mc.id,)), marks(i))),
+        Case('edit_marks', 'teacher', fixed(reverse('edit_marks', args=(mc.id,)))),
+        # Each run cancels the next class of the semester.
+        Case('cancel_class', 'teacher', lambda i: (reverse('cancel_class', args=(assc_list[-1 - i],)), None)),
+        Case('at_risk', 'admin', fixed(reverse('at_risk') + '?dept=' + stud.class_id.dept_id)),
+        Case('admin:info_attendanceclass_changelist', 'admin',
+             fixed(reverse('admin:info_attendanceclass_changelist'))),
+        # Queues a regeneration of the whole calendar, so it runs last and once.
+        Case('admin:reset_attd', 'admin',
+             fixed(reverse('admin:reset_attd'), {'startdate': str(r.start_date), 'enddate': str(r.end_date)}),
+             repeat=False),
+    ]
+
+
+def clients():
+    """A logged in client for each role."""
+    stud = Student.objects.order_by('USN').select_related('user').first()
+    ass = Assign.objects.filter(class_id=stud.class_id_id).select_related('teacher__user').order_by('id').first()
+    User.objects.create_superuser('benchmark-admin', 'admin@example.com', synthetic.PASSWORD)
+    result = {}
+    for role, username in (('student', stud.user.username), ('teacher', ass.teacher.user.username),
+                           ('admin', 'benchmark-admin')):
+        result[role] = Client()
+        if not result[role].login(username=username, password=synthetic.PASSWORD):
+            raise CommandError('Could not log in as %s' % username)
+    return result
+
+
+def request(client, case, i):
+    path, data = case.request(i)
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as ctx:
+        if data is None:
+            response = client.get(path)
+        else:
+            response = client.post(path, data)
+        # Streaming responses do their queries while being read.
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.content
+    ms = (time.perf_counter() - start) * 1000
+    sql_ms = sum(float(q['time']) for q in ctx.captured_queries) * 1000
+    return path, response.status_code, len(ctx), ms, sql_ms
+
+
+def run(repeat=5):
+    """
+    Request every case once with an empty cache, then ``repeat`` more times,
+    and return the status, query counts, and total and SQL timings of each.
+    """
+    cs = clients()
+    results = []
+    for case in build_cases():
+        client = cs[case.role]
+        cache.clear()
+        path, status, cold_queries, cold_ms, cold_sql_ms = request(client, case, 0)
+        statuses, queries, timings, sql_timings = [status], [], [], []
+        for i in range(1, repeat + 1 if case.repeat else 1):
+            _, status, n, ms, sql_ms = request(client, case, i)
+            statuses.append(status)
+            queries.append(n)
+            timings.append(ms)
+            sql_timings.append(sql_ms)
+        results.append({
+            'name': case.name,
+            'url_name': case.url_name,
+            'method': 'GET' if case.request(0)[1] is None else 'POST',
+            'path': path,
+            'status': max(statuses),
+            'queries': {'cold': cold_queries, 'warm': max(queries) if queries else None},
+            'ms': {
+                'cold': round(cold_ms, 2),
+                'median': round(statistics.median(timings), 2) if timings else None,
+                'min': round(min(timings), 2) if timings else None,
+                'max': round(max(timings), 2) if timings else None,
+            },
+            'sql_ms': {
+                'cold': round(cold_sql_ms, 2),
+                'median': round(statistics.median(sql_timings), 2) if sql_timings else None,
+            },
+        })
+    return results
+
+
+def uncovered(results):
+    """Names of the app's URLs that no case requests."""
+    covered = {r['url_name'] for r in results}
+    return [p.name for p in urls.urlpatterns if p.name not in covered]
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Compare with a previous report: any case doing more queries, or whose
+    warm median (cold time for single runs) is over ``tolerance`` times the
+    baseline's, is a regression. Timings under a millisecond are not compared.
+    """
+    before = {r['name']: r for r in baseline['cases']}
+    found = []
+    for r in results:
+        b = before.get(r['name'])
+        if b is None:
+            continue
+        for run in ('cold', 'warm'):
+            if b['queries'][run] is not None and r['queries'][run] is not None \
+                    and r['queries'][run] > b['queries'][run]:
+                found.append('%s: %d %s queries, was %d' % (r['name'], r['queries'][run], run, b['queries'][run]))
+        key = 'median' if r['ms']['median'] is not None else 'cold'
+        if b['ms'][key] is not None and r['ms'][key] > max(b['ms'][key], 1) * tolerance:
+            found.append('%s: %.1fms %s, was %.1fms' % (r['name'], r['ms'][key], key, b['ms'][key]))
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every page of the app against seeded synthetic data in a throwaway test database, ' \
+           'and write the query counts and timings as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--depts', type=int, default=2)
+        parser.add_argument('--classes', type=int, default=2, help='classes per department')
+        parser.add_argument('--students', type=int, default=60, help='students per class')
+        parser.add_argument('--courses', type=int, default=5, help='courses per department')
+        parser.add_argument('--weeks', type=int, default=16, help='weeks of attendance')
+        parser.add_argument('--repeat', type=int, default=5, help='warm runs per page')
+        parser.add_argument('--output', default='benchmark.json', help="report file, '-' for stdout")
+        parser.add_argument('--baseline', metavar='FILE', help='fail on regressions against this earlier report')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help='slowdown factor over the baseline that counts as a regression')
+
+    def handle(self, *args, **options):
+        params = {k: options[k] for k in ('seed', 'depts', 'classes', 'students', 'courses', 'weeks', 'repeat')}
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                start = time.perf_counter()
+                rows = synthetic.generate(seed=params['seed'], depts=params['depts'], classes=params['classes'],
+                                          students=params['students'], courses=params['courses'],
+                                          weeks=params['weeks'])
+                generate_s = time.perf_counter() - start
+                results = run(params['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'params': params,
+            'rows': rows,
+            'generate_s': round(generate_s, 2),
+            'cases': results,
+            'uncovered': uncovered(results),
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write('%-40s %6s %5s %5s %9s %9s' % ('page', 'status', 'qcold', 'qwarm', 'cold ms',
+                                                             'median ms'))
+            for r in results:
+                self.stdout.write('%-40s %6d %5d %5s %9.1f %9s' % (
+                    r['name'], r['status'], r['queries']['cold'],
+                    '' if r['queries']['warm'] is None else r['queries']['warm'], r['ms']['cold'],
+                    '' if r['ms']['median'] is None else '%.1f' % r['ms']['median']))
+            self.stdout.write('Report written to %s' % options['output'])
+
+        errors = ['%s: HTTP %d' % (r['name'], r['status']) for r in results if r['status'] >= 400]
+        if report['uncovered']:
+            errors.append('no benchmark for %s' % ', '.join(report['uncovered']))
+        if baseline is not None:
+            errors += regressions(results, baseline, options['tolerance'])
+        if errors:
+            raise CommandError('\n'.join(errors))
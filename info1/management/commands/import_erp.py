@@ -0,0 +1,240 @@
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from info import caching
+from info.models import Dept, Class, Course, Teacher, Student, User, Assign, AssignTime, AttendanceClass, \
+    AttendanceRange, MarksClass, StudentCourse
+
+# Import order, so that every row can refer to rows of the files before it.
+MODELS = ['dept', 'class', 'course', 'teacher', 'student', 'assign', 'assigntime']
+
+COLUMNS = {
+    'dept': ['id', 'name'],
+    'class': ['id', 'dept', 'section', 'sem'],
+    'course': ['id', 'dept', 'name', 'shortname'],
+    'teacher': ['id', 'dept', 'name'],
+    'student': ['USN', 'class_id', 'name'],
+    'assign': ['class_id', 'course', 'teacher'],
+    'assigntime': ['class_id', 'course', 'teacher', 'day', 'period'],
+}
+
+
+def read_rows(path):
+    """Return the rows of a CSV file or of a JSON list of objects as dicts of strings."""
+    with open(path, newline='') as f:
+        if os.path.splitext(path)[1].lower() == '.json':
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    return [{k: '' if v is None else str(v).strip() for k, v in row.items()} for row in rows]
+
+
+def in_chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Importer:
+    """
+    Validates every row of every file up front against the database and the
+    other files, then inserts them in batches.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.errors = []
+        self.objects = {name: [] for name in MODELS}
+        self.users = []
+        self.ids = {
+            'dept': set(Dept.objects.values_list('id', flat=True)),
+            'class': set(Class.objects.values_list('id', flat=True)),
+            'course': set(Course.objects.values_list('id', flat=True)),
+            'teacher': set(Teacher.objects.values_list('id', flat=True)),
+            'assign': set(Assign.objects.values_list('class_id_id', 'course_id', 'teacher_id')),
+        }
+        self.usernames = set()
+
+    def error(self, name, line, message):
+        self.errors.append('%s:%d: %s' % (self.files[name][0], line, message))
+
+    def validate(self):
+        for name in MODELS:
+            if name not in self.files:
+                continue
+            path, rows = self.files[name]
+            for line, row in enumerate(rows, start=2):
+                missing = [c for c in COLUMNS[name] if not row.get(c)]
+                if missing:
+                    self.error(name, line, 'missing %s' % ', '.join(missing))
+                    continue
+                try:
+                    getattr(self, 'build_' + name)(row, line)
+                except ValidationError as e:
+                    self.error(name, line, '; '.join('%s: %s' % (f, ' '.join(m)) for f, m in e.message_dict.items()))
+        self.validate_unique()
+        return not self.errors
+
+    def refer(self, name, line, kind, value):
+        if value not in self.ids[kind]:
+            self.error(name, line, 'unknown %s %r' % (kind, value))
+
+    def add(self, name, line, kind, key, obj):
+        if key in self.ids[kind]:
+            self.error(name, line, '%s %r already exists' % (kind, key))
+        else:
+            self.ids[kind].add(key)
+            self.objects[name].append(obj)
+
+    def build_dept(self, row, line):
+        d = Dept(id=row['id'], name=row['name'])
+        d.clean_fields()
+        self.add('dept', line, 'dept', d.id, d)
+
+    def build_class(self, row, line):
+        c = Class(id=row['id'], dept_id=row['dept'], section=row['section'], sem=row['sem'])
+        c.clean_fields(exclude=['dept'])
+        self.refer('class', line, 'dept', c.dept_id)
+        self.add('class', line, 'class', c.id, c)
+
+    def build_course(self, row, line):
+        c = Course(id=row['id'], dept_id=row['dept'], name=row['name'], shortname=row.get('shortname') or 'X')
+        c.clean_fields(exclude=['dept'])
+        self.refer('course', line, 'dept', c.dept_id)
+        self.add('course', line, 'course', c.id, c)
+
+    def build_teacher(self, row, line):
+        t = Teacher(id=row['id'], dept_id=row['dept'], name=row['name'], sex=row.get('sex') or 'Male',
+                    DOB=row.get('DOB') or '1980-01-01')
+        t.clean_fields(exclude=['dept', 'user'])
+        self.refer('teacher', line, 'dept', t.dept_id)
+        self.add_user('teacher', line, t, row)
+        self.add('teacher', line, 'teacher', t.id, t)
+
+    def build_student(self, row, line):
+        s = Student(USN=row['USN'], class_id_id=row['class_id'], name=row['name'], sex=row.get('sex') or 'Male',
+                    DOB=row.get('DOB') or '1998-01-01')
+        s.clean_fields(exclude=['class_id', 'user'])
+        self.refer('student', line, 'class', s.class_id_id)
+        self.add_user('student', line, s, row)
+        self.objects['student'].append(s)
+
+    def build_assign(self, row, line):
+        a = Assign(class_id_id=row['class_id'], course_id=row['course'], teacher_id=row['teacher'])
+        self.refer('assign', line, 'class', a.class_id_id)
+        self.refer('assign', line, 'course', a.course_id)
+        self.refer('assign', line, 'teacher', a.teacher_id)
+        self.add('assign', line, 'assign', (a.class_id_id, a.course_id, a.teacher_id), a)
+
+    def build_assigntime(self, row, line):
+        key = (row['class_id'], row['course'], row['teacher'])
+        at = AssignTime(day=row['day'], period=row['period'])
+        at.clean_fields(exclude=['assign'])
+        self.refer('assigntime', line, 'assign', key)
+        self.objects['assigntime'].append((key, at))
+
+    def add_user(self, name, line, profile, row):
+        username = row.get('username')
+        if not username:
+            return
+        if username in self.usernames:
+            self.error(name, line, 'username %r used twice' % username)
+        self.usernames.add(username)
+        self.users.append((User(username=username, first_name=profile.name), row.get('password'), profile))
+
+    def validate_unique(self):
+        for chunk in in_chunks(self.usernames):
+            for username in User.objects.filter(username__in=chunk).values_list('username', flat=True):
+                self.errors.append('username %r already exists' % username)
+        students = self.objects['student']
+        seen = set()
+        for s in students:
+            if s.USN in seen:
+                self.errors.append('student %r listed twice' % s.USN)
+            seen.add(s.USN)
+        for chunk in in_chunks(seen):
+            for usn in Student.objects.filter(USN__in=chunk).values_list('USN', flat=True):
+                self.errors.append('student %r already exists' % usn)
+
+    def save(self, batch_size):
+        """Insert everything, then run the provisioning the post_save signals would have done, in bulk."""
+        for u, password, _ in self.users:
+            u.password = make_password(password or None)
+        User.objects.bulk_create([u for u, _, _ in self.users], batch_size=batch_size)
+        user_ids = {}
+        for chunk in in_chunks([u.username for u, _, _ in self.users]):
+            user_ids.update(User.objects.filter(username__in=chunk).values_list('username', 'id'))
+        for u, _, profile in self.users:
+            profile.user_id = user_ids[u.username]
+
+        for name, model in (('dept', Dept), ('class', Class), ('course', Course), ('teacher', Teacher),
+                            ('student', Student), ('assign', Assign)):
+            model.objects.bulk_create(self.objects[name], batch_size=batch_size)
+
+        assign_ids = {}
+        for a in Assign.objects.values_list('id', 'class_id_id', 'course_id', 'teacher_id').iterator():
+            assign_ids[a[1:]] = a[0]
+        new_assigns = self.objects['assign']
+        for a in new_assigns:
+            a.id = assign_ids[(a.class_id_id, a.course_id, a.teacher_id)]
+        assign_times = []
+        for key, at in self.objects['assigntime']:
+            at.assign_id = assign_ids[key]
+            assign_times.append(at)
+        AssignTime.objects.bulk_create(assign_times, batch_size=batch_size)
+
+        MarksClass.objects.provision(new_assigns)
+        for chunk in in_chunks(self.objects['student']):
+            StudentCourse.objects.provision(students=chunk)
+        for chunk in in_chunks(new_assigns, 50):
+            StudentCourse.objects.provision(assigns=chunk)
+        r = AttendanceRange.objects.first()
+        if r is not None and assign_times:
+            AttendanceClass.objects.generate(r.start_date, r.end_date, assign_times)
+
+        caching.bump('timetable', 'all')
+        caching.bump('class', *{s.class_id_id for s in self.objects['student']})
+        caching.bump('class', *{a.class_id_id for a in new_assigns})
+
+
+class Command(BaseCommand):
+    help = 'Bulk import departments, classes, courses, teachers, students, assigns and timetable slots ' \
+           'from CSV or JSON files'
+
+    def add_arguments(self, parser):
+        for name in MODELS:
+            parser.add_argument('--%s' % name, metavar='FILE',
+                                help='CSV or JSON file of %s rows with columns %s'
+                                     % (name, ', '.join(COLUMNS[name])))
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        files = {name: (options[name], read_rows(options[name])) for name in MODELS if options[name]}
+        if not files:
+            raise CommandError('Nothing to import, pass at least one of %s'
+                               % ', '.join('--%s' % name for name in MODELS))
+
+        start = time.monotonic()
+        importer = Importer(files)
+        if not importer.validate():
+            raise CommandError('%d errors, nothing imported:\n%s'
+                               % (len(importer.errors), '\n'.join(importer.errors[:50])))
+        with transaction.atomic():
+            importer.save(options['batch_size'])
+        elapsed = time.monotonic() - start
+
+        total = 0
+        for name in MODELS:
+            count = len(importer.objects[name])
+            if name in files:
+                self.stdout.write('%-10s %6d rows' % (name, count))
+            total += count
+        self.stdout.write(self.style.SUCCESS('Imported %d rows in %.2fs (%.0f rows/s)'
+                                             % (total, elapsed, total / elapsed if elapsed else total)))
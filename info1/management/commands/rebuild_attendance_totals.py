@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from info.models import AttendanceTotal
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored attendance counters of every AttendanceTotal from the Attendance table'
+
+    def handle(self, *args, **options):
+        count = AttendanceTotal.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d attendance totals' % count))
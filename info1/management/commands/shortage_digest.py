@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.core.mail import send_mass_mail
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from info.models import Assign, AttendanceTotal, MIN_ATTENDANCE
+
+
+def digest_lines(at_list, new_since):
+    """One line per student and course, marked NEW if the student became short on or after ``new_since``."""
+    for a in at_list:
+        yield '%-4s %-10s %-12s %-30s %-10s %3d/%-3d %6.2f%%  %d classes to attend' % (
+            'NEW' if a.shortage_since >= new_since else '', a.student.class_id_id, a.student_id, a.student.name,
+            a.course_id, a.att_class, a.total_class, a.attendance, a.classes_to_attend)
+
+
+class Command(BaseCommand):
+    help = ('Report the students short of %d%% attendance, per department, marking those who became short '
+            'since the last run. Meant to be run nightly, e.g. from cron.' % MIN_ATTENDANCE)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dept', help='Only the courses of this department')
+        parser.add_argument('--days', type=int, default=1, help='Days since the last run, for the NEW mark')
+        parser.add_argument('--email', action='store_true',
+                            help='Also mail every teacher with an email address the students of their classes')
+
+    def handle(self, *args, **options):
+        at_list = list(AttendanceTotal.objects.at_risk(options['dept']))
+        new_since = timezone.localdate() - timedelta(days=options['days'])
+
+        by_dept = {}
+        for a in at_list:
+            by_dept.setdefault(a.course.dept_id, []).append(a)
+        for dept, rows in sorted(by_dept.items()):
+            new = sum(a.shortage_since >= new_since for a in rows)
+            self.stdout.write('%s: %d short of attendance, %d new' % (dept, len(rows), new))
+            for line in digest_lines(rows, new_since):
+                self.stdout.write('  ' + line)
+        if not at_list:
+            self.stdout.write('No student is short of attendance.')
+
+        if options['email']:
+            sent = send_mass_mail(self.messages(at_list, new_since))
+            self.stdout.write('Mailed %d teachers' % sent)
+
+    def messages(self, at_list, new_since):
+        """One mail per teacher, listing the short students of the classes it teaches."""
+        by_class = {}
+        for a in at_list:
+            by_class.setdefault((a.student.class_id_id, a.course_id), []).append(a)
+        by_teacher = {}
+        for class_id, course_id, email in Assign.objects.filter(course__in={a.course_id for a in at_list}) \
+                .exclude(teacher__user__email='').exclude(teacher__user__email__isnull=True) \
+                .values_list('class_id', 'course_id', 'teacher__user__email'):
+            by_teacher.setdefault(email, []).extend(by_class.get((class_id, course_id), ()))
+        for email, rows in sorted(by_teacher.items()):
+            if rows:
+                body = '\n'.join(digest_lines(rows, new_since))
+                yield ('Students short of attendance', body, None, [email])
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+# The processes of the pool import this module before Django is set up in
+# them, so the models are only imported inside the functions.
+
+
+def setup_process():
+    django.setup()
+
+
+def run_job(job_id):
+    from info import jobs
+    close_old_connections()
+    try:
+        return jobs.run(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs queued by the admin, in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Jobs run at once, each in a process of the pool; 0 runs them in this process')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds between looks at an empty queue')
+        parser.add_argument('--stale', type=int, default=600,
+                            help='Seconds without progress after which a running job is queued again')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        from info import caching, jobs
+        from info.models import Job
+
+        if not caching.is_shared():
+            raise CommandError('The cache is private to each process, so the web processes would keep serving '
+                               'what the jobs change; set ERP_CACHE_BACKEND to file or redis.')
+        name = '%s:%d' % (socket.gethostname(), os.getpid())
+        requeued = Job.objects.requeue_stale(timedelta(seconds=options['stale']))
+        if requeued:
+            self.stdout.write('Queued %d stale jobs again' % requeued)
+        processes = options['processes']
+
+        if processes == 0:
+            while True:
+                job = Job.objects.claim(name)
+                if job is not None:
+                    self.report(job, jobs.run(job.id))
+                elif options['burst']:
+                    return
+                else:
+                    time.sleep(options['poll'])
+
+        # Spawned rather than forked, so that no process inherits the
+        # database connections of another.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=setup_process) as pool:
+            running = {}
+            while True:
+                while len(running) < processes:
+                    job = Job.objects.claim(name)
+                    if job is None:
+                        break
+                    running[pool.submit(run_job, job.id)] = job
+                if not running:
+                    if options['burst']:
+                        return
+                    time.sleep(options['poll'])
+                    continue
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.report(running.pop(future), future.result())
+
+    def report(self, job, status):
+        style = self.style.SUCCESS if status == 'done' else self.style.ERROR
+        self.stdout.write(style('%s: %s' % (job, status)))
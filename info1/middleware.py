@@ -0,0 +1,138 @@
+"""
+Per-request latency and SQL instrumentation, enabled with ERP_INSTRUMENTATION=1.
+
+For every request it measures the wall time, the number and total time of
+SQL queries, and the queries that ran more than once with the same shape,
+which is how per-row (N+1) queries show up. It then
+
+- adds a Server-Timing header, shown by browsers in their network panel,
+- logs one JSON line to the ``info.requests`` logger, as a warning when a
+  query shape repeats N_PLUS_ONE times or more,
+- records the request in an in-process rolling window per URL name, which
+  staff can see at /admin/request_stats/.
+
+Queries run while a streaming response is being sent are not counted.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.db import connections
+
+logger = logging.getLogger('info.requests')
+
+# Repeats of one query shape in a request that are logged as a warning.
+N_PLUS_ONE = 5
+
+
+def fingerprint(sql):
+    """The shape of a query: its SQL with numbers and IN lists of any length made alike."""
+    sql = re.sub(r'\((?:%s, )*%s\)', '(...)', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+class QueryRecorder:
+    """An execute wrapper counting and timing the queries of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, limit=5):
+        return [{'sql': sql, 'count': count} for sql, count in self.fingerprints.most_common(limit) if count > 1]
+
+
+class RequestStats:
+    """The wall time, query count and SQL time of the latest requests of each URL name."""
+
+    # Upper bounds in ms of the histogram buckets; the last bucket is open.
+    buckets = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self, size=500):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, ms, queries, sql_ms):
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=self.size)).append((ms, queries, sql_ms))
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """One row per URL name, the ones taking the most time in total first."""
+        with self.lock:
+            samples = {name: list(s) for name, s in self.samples.items()}
+        rows = []
+        for name, s in samples.items():
+            ms = sorted(sample[0] for sample in s)
+            queries = [sample[1] for sample in s]
+            histogram = [0] * (len(self.buckets) + 1)
+            for t in ms:
+                histogram[sum(t > bound for bound in self.buckets)] += 1
+            rows.append({
+                'name': name,
+                'count': len(ms),
+                'total_ms': sum(ms),
+                'p50_ms': ms[(len(ms) - 1) // 2],
+                'p95_ms': ms[int((len(ms) - 1) * 0.95)],
+                'max_ms': ms[-1],
+                'avg_queries': sum(queries) / len(queries),
+                'max_queries': max(queries),
+                'avg_sql_ms': sum(sample[2] for sample in s) / len(s),
+                'histogram': histogram,
+            })
+        return sorted(rows, key=lambda r: -r['total_ms'])
+
+
+stats = RequestStats()
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        ms = (time.perf_counter() - start) * 1000
+        sql_ms = recorder.time * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else '<unresolved>'
+        response['Server-Timing'] = 'total;dur=%.1f, sql;dur=%.1f;desc="%d queries"' % (ms, sql_ms, recorder.count)
+        stats.add(name, ms, recorder.count, sql_ms)
+
+        duplicates = recorder.duplicates()
+        level = logging.WARNING if duplicates and duplicates[0]['count'] >= N_PLUS_ONE else logging.INFO
+        logger.log(level, json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'url_name': name,
+            'status': response.status_code,
+            'ms': round(ms, 1),
+            'queries': recorder.count,
+            'sql_ms': round(sql_ms, 1),
+            'duplicates': duplicates,
+        }))
+        return response
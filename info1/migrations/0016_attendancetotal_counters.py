@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:12
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    Attendance = apps.get_model('info', 'Attendance')
+    AttendanceTotal = apps.get_model('info', 'AttendanceTotal')
+    counts = Attendance.objects.values_list('student_id', 'course_id') \
+        .annotate(total=Count('id'), attended=Count('id', filter=Q(status=True))) \
+        .order_by()
+    counts = {(s, c): (attended, total) for s, c, total, attended in counts}
+    totals = list(AttendanceTotal.objects.all())
+    for t in totals:
+        t.att_class, t.total_class = counts.get((t.student_id, t.course_id), (0, 0))
+    AttendanceTotal.objects.bulk_update(totals, ['att_class', 'total_class'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0015_attendancerange'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='attendanceclass',
+            options={'verbose_name': 'Attendance', 'verbose_name_plural': 'Attendance'},
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='att_class',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='total_class',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
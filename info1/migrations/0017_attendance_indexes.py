@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:20
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def remove_duplicate_attendance(apps, schema_editor):
+    Attendance = apps.get_model('info', 'Attendance')
+    AttendanceTotal = apps.get_model('info', 'AttendanceTotal')
+    duplicates = Attendance.objects.values('attendanceclass_id', 'student_id') \
+        .annotate(n=Count('id'), keep=Max('id')).filter(n__gt=1).order_by()
+    if not duplicates:
+        return
+    for d in duplicates:
+        Attendance.objects.filter(attendanceclass_id=d['attendanceclass_id'], student_id=d['student_id']) \
+            .exclude(id=d['keep']).delete()
+
+    counts = Attendance.objects.values_list('student_id', 'course_id') \
+        .annotate(total=Count('id'), attended=Count('id', filter=Q(status=True))) \
+        .order_by()
+    counts = {(s, c): (attended, total) for s, c, total, attended in counts}
+    totals = list(AttendanceTotal.objects.all())
+    for t in totals:
+        t.att_class, t.total_class = counts.get((t.student_id, t.course_id), (0, 0))
+    AttendanceTotal.objects.bulk_update(totals, ['att_class', 'total_class'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0016_attendancetotal_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_attendance, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together={('attendanceclass', 'student')},
+        ),
+        migrations.AddIndex(
+            model_name='assigntime',
+            index=models.Index(fields=['assign', 'day', 'period'], name='assigntime_assign_slot'),
+        ),
+        migrations.AddIndex(
+            model_name='assigntime',
+            index=models.Index(fields=['day', 'period'], name='assigntime_slot'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['course', 'student', 'status'], name='attendance_course_student'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['attendanceclass', 'course'], name='attendance_class_course'),
+        ),
+        migrations.AddIndex(
+            model_name='attendanceclass',
+            index=models.Index(fields=['assign', 'date'], name='attendanceclass_assign_date'),
+        ),
+    ]
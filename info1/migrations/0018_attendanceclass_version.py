@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0017_attendance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendanceclass',
+            name='submission_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='attendanceclass',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='attendanceclass',
+            constraint=models.UniqueConstraint(condition=models.Q(('submission_key', ''), _negated=True), fields=('assign', 'submission_key'), name='attendanceclass_submission_key'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:52
+
+from django.db import migrations, models
+from django.utils import timezone
+
+MIN_ATTENDANCE = 75
+
+
+def fill_shortage(apps, schema_editor):
+    AttendanceTotal = apps.get_model('info', 'AttendanceTotal')
+    today = timezone.localdate()
+    totals = list(AttendanceTotal.objects.all())
+    for t in totals:
+        t.classes_to_attend = max(-((100 * t.att_class - MIN_ATTENDANCE * t.total_class) // (100 - MIN_ATTENDANCE)), 0)
+        t.shortage = 100 * t.att_class < MIN_ATTENDANCE * t.total_class
+        t.shortage_since = today if t.shortage else None
+    AttendanceTotal.objects.bulk_update(totals, ['classes_to_attend', 'shortage', 'shortage_since'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0019_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='classes_to_attend',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='shortage',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='shortage_since',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='attendancetotal',
+            index=models.Index(condition=models.Q(('shortage', True)), fields=['course', 'student'], name='attendancetotal_shortage'),
+        ),
+        migrations.RunPython(fill_shortage, migrations.RunPython.noop),
+    ]
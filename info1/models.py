@@ -1,10 +1,17 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 import math
+import threading
+from itertools import product
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.db.models.signals import post_save, post_delete
 from datetime import timedelta
 
+from . import caching
+
 # Create your models here.
 sex_choice = (
     ('Male', 'Male'),
@@ -32,6 +39,9 @@ DAYS_OF_WEEK = (
     ('Saturday', 'Saturday'),
 )
 
+# timetable column of each period, leaving columns 4 and 8 for the break and lunch
+period_columns = {slot[0]: col for slot, col in zip(time_slots, (1, 2, 3, 5, 6, 7, 9, 10, 11))}
+
 test_name = (
     ('Internal test 1', 'Internal test 1'),
     ('Internal test 2', 'Internal test 2'),
@@ -41,6 +51,26 @@ test_name = (
     ('Semester End Exam', 'Semester End Exam'),
 )
 
+# tests that make up the CIE
+cie_tests = [name[0] for name in test_name[:5]]
+
+# Attendance % below which a student is short of attendance in a course.
+MIN_ATTENDANCE = 75
+
+job_kinds = (
+    ('reset_attendance', 'Reset attendance'),
+    ('extend_attendance', 'Extend attendance'),
+    ('provision_assigns', 'Create marks of assigns'),
+    ('delete_assigns', 'Delete assigns'),
+)
+
+job_status = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
 
 class User(AbstractUser):
     @property
@@ -85,8 +115,19 @@ class Class(models.Model):
         verbose_name_plural = 'classes'
 
     def __str__(self):
-        d = Dept.objects.get(name=self.dept)
-        return '%s : %d %s' % (d.name, self.sem, self.section)
+        return '%s : %d %s' % (self.dept.name, self.sem, self.section)
+
+
+class StudentManager(models.Manager):
+    def bulk_import(self, students, batch_size=500):
+        """
+        Insert many unsaved Student instances at once and provision their
+        StudentCourse and Marks rows in one pass. post_save does not fire.
+        """
+        with transaction.atomic():
+            students = self.bulk_create(students, batch_size=batch_size)
+            StudentCourse.objects.provision(students=students)
+        return students
 
 
 class Student(models.Model):
@@ -97,10 +138,23 @@ class Student(models.Model):
     sex = models.CharField(max_length=50, choices=sex_choice, default='Male')
     DOB = models.DateField(default='1998-01-01')
 
+    objects = StudentManager()
+
     def __str__(self):
         return self.name
 
 
+class TeacherQuerySet(models.QuerySet):
+    def free_at(self, day, period):
+        """
+        Narrow the teachers to those with no AssignTime in the given day and
+        period, as one anti-join query. Chain it after a class or department
+        filter to narrow the search.
+        """
+        busy = AssignTime.objects.filter(day=day, period=period).values('assign__teacher_id')
+        return self.exclude(id__in=busy)
+
+
 class Teacher(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True)
     id = models.CharField(primary_key=True, max_length=100)
@@ -109,6 +163,8 @@ class Teacher(models.Model):
     sex = models.CharField(max_length=50, choices=sex_choice, default='Male')
     DOB = models.DateField(default='1980-01-01')
 
+    objects = TeacherQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -122,10 +178,28 @@ class Assign(models.Model):
         unique_together = (('course', 'class_id', 'teacher'),)
 
     def __str__(self):
-        cl = Class.objects.get(id=self.class_id_id)
-        cr = Course.objects.get(id=self.course_id)
-        te = Teacher.objects.get(id=self.teacher_id)
-        return '%s : %s : %s' % (te.name, cr.shortname, cl)
+        return '%s : %s : %s' % (self.teacher.name, self.course.shortname, self.class_id)
+
+
+class AssignTimeManager(models.Manager):
+    def grid(self, **filters):
+        """
+        Return the weekly timetable of the AssignTimes matching ``filters`` as a
+        6 x 12 matrix. The first column holds the day, the break and lunch
+        columns are empty and every other cell holds the AssignTime of that
+        slot, or '' if it is free. The AssignTimes are read in one query with
+        their assign, course and class, and the matrix is cached until an
+        Assign or AssignTime changes.
+        """
+        def build():
+            matrix = [[d[0]] + ['' for j in range(11)] for d in DAYS_OF_WEEK]
+            rows = {d[0]: i for i, d in enumerate(DAYS_OF_WEEK)}
+            for a in self.filter(**filters).select_related('assign__course', 'assign__class_id'):
+                matrix[rows[a.day]][period_columns[a.period]] = a
+            return matrix
+
+        name = 'timetable:' + ':'.join('%s=%s' % f for f in sorted(filters.items()))
+        return caching.cached(name, [('timetable', 'all')], build)
 
 
 class AssignTime(models.Model):
@@ -133,15 +207,158 @@ class AssignTime(models.Model):
     period = models.CharField(max_length=50, choices=time_slots, default='11:00 - 11:50')
     day = models.CharField(max_length=15, choices=DAYS_OF_WEEK)
 
+    objects = AssignTimeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['assign', 'day', 'period'], name='assigntime_assign_slot'),
+            models.Index(fields=['day', 'period'], name='assigntime_slot'),
+        ]
+
+
+class AttendanceClassManager(models.Manager):
+    def generate(self, start_date, end_date, assign_times=None):
+        """
+        Create an AttendanceClass for every date from start_date up to, but not
+        including, end_date on which one of the assign_times (all AssignTimes by
+        default) falls. Dates that already have one are skipped, so the range
+        can be regenerated or extended without touching existing attendance.
+        Returns the number of rows created.
+        """
+        if assign_times is None:
+            slots = AssignTime.objects.values_list('assign_id', 'day')
+            existing = self.all()
+        else:
+            slots = [(asst.assign_id, asst.day) for asst in assign_times]
+            existing = self.filter(assign__in={assign_id for assign_id, _ in slots})
+
+        wanted = set()
+        for assign_id, day in slots:
+            single_date = start_date + timedelta((days[day] - start_date.isoweekday()) % 7)
+            while single_date < end_date:
+                wanted.add((assign_id, single_date))
+                single_date += timedelta(7)
+        if not wanted:
+            return 0
+
+        existing = existing.filter(date__gte=start_date, date__lt=end_date).values_list('assign_id', 'date')
+        missing = wanted.difference(existing)
+        self.bulk_create([AttendanceClass(assign_id=assign_id, date=single_date)
+                          for assign_id, single_date in sorted(missing)], batch_size=500)
+        return len(missing)
+
+    def take_extra(self, assign, date, roll, key=''):
+        """
+        Create a class of ``assign`` on ``date`` outside the timetable and
+        record its roll call. With ``key``, a retry of the submission that
+        created a class under that key returns that class instead of creating
+        another one. Returns the class and whether it was created.
+        """
+        try:
+            with transaction.atomic():
+                assc = self.create(assign=assign, date=date, submission_key=key)
+                assc.submit(roll)
+        except IntegrityError:
+            assc = self.filter(assign=assign, submission_key=key).first() if key else None
+            if assc is None:
+                raise
+            return assc, False
+        return assc, True
+
+
+class AttendanceConflict(Exception):
+    """A roll call was submitted for a version of its class that has been changed since."""
+
+    def __init__(self, assc):
+        super().__init__('Attendance of %s was changed since version %s' % (assc.date, assc.version))
+        self.assc = assc
+
 
 class AttendanceClass(models.Model):
     assign = models.ForeignKey(Assign, on_delete=models.CASCADE)
     date = models.DateField()
     status = models.IntegerField(default=0)
+    # Bumped by every change to the roll call, for optimistic locking.
+    version = models.IntegerField(default=0)
+    # Idempotency key of the latest submission, so that a retry is a no-op.
+    submission_key = models.CharField(max_length=64, blank=True, default='')
+
+    objects = AttendanceClassManager()
 
     class Meta:
         verbose_name = 'Attendance'
         verbose_name_plural = 'Attendance'
+        indexes = [
+            models.Index(fields=['assign', 'date'], name='attendanceclass_assign_date'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['assign', 'submission_key'], condition=~Q(submission_key=''),
+                                    name='attendanceclass_submission_key'),
+        ]
+
+    def submit(self, roll, key='', version=None):
+        """
+        Record a roll call for this class. ``roll`` maps each student's USN to
+        True (present) or False (absent). Existing Attendance rows are updated,
+        missing ones created and the class marked as taken in one transaction.
+
+        The first statement claims the class row by bumping its version, so
+        concurrent submissions of the same class run one after the other and
+        each sees the rows of the one before. With ``version``, the roll call
+        is only recorded if the class is still at that version, otherwise
+        AttendanceConflict is raised. With ``key``, a retry of the submission
+        last recorded under that key changes nothing. Returns False for such a
+        retry, True otherwise.
+        """
+        course_id = self.assign.course_id
+        # The kept roll call of a cancelled class counts again once it is taken.
+        was_cancelled = self.status == 2
+        with transaction.atomic():
+            claim = AttendanceClass.objects.filter(id=self.id)
+            if version is not None:
+                claim = claim.filter(version=version)
+            if key:
+                claim = claim.exclude(submission_key=key)
+            changes = {'status': 1, 'version': F('version') + 1}
+            if key:
+                changes['submission_key'] = key
+            if not claim.update(**changes):
+                self.refresh_from_db(fields=['status', 'version', 'submission_key'])
+                if key and self.submission_key == key:
+                    return False
+                raise AttendanceConflict(self)
+            self.refresh_from_db(fields=['status', 'version', 'submission_key'])
+
+            existing = {a.student_id: a for a in self.attendance_set.all()}
+            to_update = []
+            to_create = []
+            for usn, status in roll.items():
+                a = existing.get(usn)
+                if a is None:
+                    to_create.append(Attendance(course_id=course_id, student_id=usn, status=status, date=self.date,
+                                                attendanceclass=self))
+                elif a.status != status:
+                    a.status = status
+                    to_update.append(a)
+
+            # The rows are written in the same transaction as the claim, so no
+            # other submission can insert them meanwhile; the unique index on
+            # (attendanceclass, student) backs this up for any other writer.
+            Attendance.objects.bulk_update(to_update, ['status'], batch_size=500)
+            Attendance.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+            changed = list(roll) if was_cancelled else [a.student_id for a in to_update + to_create]
+            if changed:
+                AttendanceTotal.objects.refresh(changed, [course_id])
+        return True
+
+    def cancel(self):
+        """Mark the class as cancelled. Its roll call is kept, but no longer counted in AttendanceTotal."""
+        with transaction.atomic():
+            AttendanceClass.objects.filter(id=self.id).update(status=2, version=F('version') + 1)
+            self.status = 2
+            stud_list = list(self.attendance_set.values_list('student_id', flat=True))
+            if stud_list:
+                AttendanceTotal.objects.refresh(stud_list, [self.assign.course_id])
 
 
 class Attendance(models.Model):
@@ -151,80 +368,287 @@ class Attendance(models.Model):
     date = models.DateField(default='2018-10-23')
     status = models.BooleanField(default='True')
 
+    class Meta:
+        unique_together = (('attendanceclass', 'student'),)
+        indexes = [
+            models.Index(fields=['course', 'student', 'status'], name='attendance_course_student'),
+            models.Index(fields=['attendanceclass', 'course'], name='attendance_class_course'),
+        ]
+
     def __str__(self):
-        sname = Student.objects.get(name=self.student)
-        cname = Course.objects.get(name=self.course)
-        return '%s : %s' % (sname.name, cname.shortname)
+        return '%s : %s' % (self.student.name, self.course.shortname)
+
+
+class AttendanceTotalQuerySet(models.QuerySet):
+    def at_risk(self, dept=None):
+        """
+        The rows of the students short of attendance in the courses of
+        ``dept``, or of every department, most classes to attend first, with
+        the student, its class and the course loaded. One query, reading
+        the partial index of the short rows.
+        """
+        qs = self.filter(shortage=True)
+        if dept is not None:
+            qs = qs.filter(course__dept=dept)
+        return qs.select_related('student__class_id', 'course') \
+            .order_by('-classes_to_attend', 'course_id', 'student_id')
+
+
+# The (student, course) pairs whose Attendance rows were deleted in this
+# thread's transaction, recounted once it commits.
+_stale_totals = threading.local()
+
+
+def _stale_pairs():
+    if not hasattr(_stale_totals, 'pairs'):
+        _stale_totals.pairs = set()
+    return _stale_totals.pairs
+
+
+class AttendanceTotalManager(models.Manager.from_queryset(AttendanceTotalQuerySet)):
+    def refresh_on_commit(self, student, course):
+        """
+        Recount the counters of ``student`` in ``course`` once the current
+        transaction commits. The pairs are collected, so deleting a whole
+        class or assign recounts each of them once.
+        """
+        _stale_pairs().add((student, course))
+        transaction.on_commit(self.refresh_stale)
+
+    def refresh_stale(self):
+        """Recount the pairs collected by refresh_on_commit() whose student and course still exist."""
+        pairs = _stale_pairs()
+        if not pairs:
+            return
+        _stale_totals.pairs = set()
+        students = set(Student.objects.filter(USN__in={s for s, _ in pairs}).values_list('USN', flat=True))
+        courses = set(Course.objects.filter(id__in={c for _, c in pairs}).values_list('id', flat=True))
+        by_course = {}
+        for s, c in pairs:
+            if s in students and c in courses:
+                by_course.setdefault(c, []).append(s)
+        for c, studs in sorted(by_course.items()):
+            self.refresh(studs, [c])
+
+    def refresh(self, students, courses):
+        """
+        Recompute the stored counters for every (student, course) pair of the
+        given students and courses from the Attendance rows of the classes not
+        cancelled, creating the missing AttendanceTotal rows.
+        """
+        student_ids = [getattr(s, 'pk', s) for s in students]
+        course_ids = [getattr(c, 'pk', c) for c in courses]
+        if _stale_pairs():
+            _stale_pairs().difference_update(product(student_ids, course_ids))
+        counts = Attendance.objects.filter(student__in=student_ids, course__in=course_ids) \
+            .exclude(attendanceclass__status=2).values_list('student_id', 'course_id') \
+            .annotate(total=Count('id'), attended=Count('id', filter=Q(status=True))) \
+            .order_by()
+        counts = {(s, c): (attended, total) for s, c, total, attended in counts}
+        existing = {(t.student_id, t.course_id): t
+                    for t in self.filter(student__in=student_ids, course__in=course_ids)}
+
+        to_update = []
+        to_create = []
+        for s in student_ids:
+            for c in course_ids:
+                attended, total = counts.get((s, c), (0, 0))
+                t = existing.get((s, c))
+                if t is None:
+                    t = AttendanceTotal(student_id=s, course_id=c)
+                    t.set_counts(attended, total)
+                    to_create.append(t)
+                elif t.set_counts(attended, total):
+                    to_update.append(t)
+
+        with transaction.atomic():
+            self.bulk_update(to_update, AttendanceTotal.counters, batch_size=500)
+            self.bulk_create(to_create, batch_size=500)
+        changed = to_update + to_create
+        caching.bump('student', *{t.student_id for t in changed})
+        caching.bump('course', *{t.course_id for t in changed})
+
+    def rebuild(self):
+        """
+        Recompute the counters of every AttendanceTotal from scratch.
+        Returns the number of rows written.
+        """
+        counts = Attendance.objects.exclude(attendanceclass__status=2).values_list('student_id', 'course_id') \
+            .annotate(total=Count('id'), attended=Count('id', filter=Q(status=True))) \
+            .order_by()
+        counts = {(s, c): (attended, total) for s, c, total, attended in counts}
+
+        to_update = []
+        for t in self.all():
+            t.set_counts(*counts.pop((t.student_id, t.course_id), (0, 0)))
+            to_update.append(t)
+        to_create = []
+        for (s, c), (attended, total) in counts.items():
+            t = AttendanceTotal(student_id=s, course_id=c)
+            t.set_counts(attended, total)
+            to_create.append(t)
+
+        with transaction.atomic():
+            self.bulk_update(to_update, AttendanceTotal.counters, batch_size=500)
+            self.bulk_create(to_create, batch_size=500)
+        changed = to_update + to_create
+        caching.bump('student', *{t.student_id for t in changed})
+        caching.bump('course', *{t.course_id for t in changed})
+        return len(changed)
+
+    def fetch(self, students, courses):
+        """
+        Return the AttendanceTotal rows of the given students and courses with
+        student and course loaded, creating any that are missing.
+        """
+        qs = self.filter(student__in=students, course__in=courses) \
+            .select_related('student', 'course').order_by('course_id', 'student_id')
+        att_list = list(qs)
+        if len(att_list) < len(students) * len(courses):
+            self.refresh(students, courses)
+            att_list = list(qs.all())
+        return att_list
 
 
 class AttendanceTotal(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    att_class = models.IntegerField(default=0)
+    total_class = models.IntegerField(default=0)
+    # Follow from the two counters above; written with them by set_counts().
+    classes_to_attend = models.IntegerField(default=0)
+    shortage = models.BooleanField(default=False)
+    shortage_since = models.DateField(null=True, blank=True)
 
-    class Meta:
-        unique_together = (('student', 'course'),)
+    objects = AttendanceTotalManager()
 
-    @property
-    def att_class(self):
-        stud = Student.objects.get(name=self.student)
-        cr = Course.objects.get(name=self.course)
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
-        return att_class
+    counters = ['att_class', 'total_class', 'classes_to_attend', 'shortage', 'shortage_since']
 
-    @property
-    def total_class(self):
-        stud = Student.objects.get(name=self.student)
-        cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
-        return total_class
+    class Meta:
+        unique_together = (('student', 'course'),)
+        indexes = [
+            models.Index(fields=['course', 'student'], condition=Q(shortage=True), name='attendancetotal_shortage'),
+        ]
 
     @property
     def attendance(self):
-        stud = Student.objects.get(name=self.student)
-        cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
-        if total_class == 0:
+        if self.total_class == 0:
             attendance = 0
         else:
-            attendance = round(att_class / total_class * 100, 2)
+            attendance = round(self.att_class / self.total_class * 100, 2)
         return attendance
 
-    @property
-    def classes_to_attend(self):
-        stud = Student.objects.get(name=self.student)
-        cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
-        cta = math.ceil((0.75 * total_class - att_class) / 0.25)
-        if cta < 0:
+    def set_counts(self, att_class, total_class):
+        """
+        Set the counters, the classes the student must attend in a row to
+        reach MIN_ATTENDANCE and whether it is short of it, and since when.
+        Returns whether anything changed.
+        """
+        # Ceiling of (MIN_ATTENDANCE * total - 100 * attended) / (100 - MIN_ATTENDANCE), in integers.
+        cta = max(-((100 * att_class - MIN_ATTENDANCE * total_class) // (100 - MIN_ATTENDANCE)), 0)
+        shortage = 100 * att_class < MIN_ATTENDANCE * total_class
+        if shortage:
+            since = self.shortage_since if self.shortage else timezone.localdate()
+        else:
+            since = None
+        values = (att_class, total_class, cta, shortage, since)
+        if values == tuple(getattr(self, f) for f in self.counters):
+            return False
+        for f, value in zip(self.counters, values):
+            setattr(self, f, value)
+        return True
+
+
+class StudentCourseQuerySet(models.QuerySet):
+    def with_cie(self):
+        """
+        Annotate each row with ``cie``: half the sum of its CIE test marks,
+        rounded up, computed in the database.
+        """
+        total = Coalesce(Sum('marks__marks1', filter=Q(marks__name__in=cie_tests)), 0)
+        return self.annotate(cie=(total + 1) / 2)
+
+    def with_attendance(self):
+        """
+        Annotate each row with the ``att_class`` and ``total_class`` counters of
+        its AttendanceTotal.
+        """
+        totals = AttendanceTotal.objects.filter(student=OuterRef('student'), course=OuterRef('course'))
+        return self.annotate(att_class=Subquery(totals.values('att_class')),
+                             total_class=Subquery(totals.values('total_class')))
+
+
+class StudentCourseManager(models.Manager.from_queryset(StudentCourseQuerySet)):
+    def provision(self, students=(), assigns=()):
+        """
+        Create the StudentCourse rows, each with one Marks row per test, that
+        are missing for the given students and assigns: a student needs one for
+        every course assigned to its class, an assign one for every student of
+        its class. Returns the number of StudentCourse rows created.
+        """
+        pairs = set()
+        stud_classes = {s.pk: s.class_id_id for s in students}
+        if stud_classes:
+            courses = {}
+            for class_id, course_id in Assign.objects.filter(class_id__in=set(stud_classes.values())) \
+                    .values_list('class_id_id', 'course_id'):
+                courses.setdefault(class_id, set()).add(course_id)
+            for usn, class_id in stud_classes.items():
+                pairs.update((usn, course_id) for course_id in courses.get(class_id, ()))
+        ass_courses = {(a.class_id_id, a.course_id) for a in assigns}
+        if ass_courses:
+            studs = {}
+            for class_id, usn in Student.objects.filter(class_id__in={c for c, _ in ass_courses}) \
+                    .values_list('class_id_id', 'USN'):
+                studs.setdefault(class_id, []).append(usn)
+            for class_id, course_id in ass_courses:
+                pairs.update((usn, course_id) for usn in studs.get(class_id, ()))
+        if not pairs:
+            return 0
+
+        student_ids = {s for s, _ in pairs}
+        course_ids = {c for _, c in pairs}
+        existing = self.filter(student__in=student_ids, course__in=course_ids)
+        pairs -= set(existing.values_list('student_id', 'course_id'))
+        if not pairs:
             return 0
-        return cta
+
+        with transaction.atomic():
+            self.bulk_create([StudentCourse(student_id=s, course_id=c) for s, c in sorted(pairs)],
+                             batch_size=500)
+            sc_ids = [pk for pk, s, c in existing.values_list('id', 'student_id', 'course_id')
+                      if (s, c) in pairs]
+            Marks.objects.bulk_create([Marks(studentcourse_id=pk, name=name[0])
+                                       for pk in sorted(sc_ids) for name in test_name], batch_size=500)
+        caching.bump('student', *student_ids)
+        caching.bump('course', *course_ids)
+        return len(pairs)
 
 
 class StudentCourse(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
 
+    objects = StudentCourseManager()
+
     class Meta:
         unique_together = (('student', 'course'),)
         verbose_name_plural = 'Marks'
 
     def __str__(self):
-        sname = Student.objects.get(name=self.student)
-        cname = Course.objects.get(name=self.course)
-        return '%s : %s' % (sname.name, cname.shortname)
+        return '%s : %s' % (self.student.name, self.course.shortname)
 
     def get_cie(self):
-        marks_list = self.marks_set.all()
-        m = []
-        for mk in marks_list:
-            m.append(mk.marks1)
-        cie = math.ceil(sum(m[:5]) / 2)
-        return cie
+        if not hasattr(self, 'cie'):
+            total = self.marks_set.filter(name__in=cie_tests).aggregate(total=Sum('marks1'))['total'] or 0
+            self.cie = math.ceil(total / 2)
+        return self.cie
 
     def get_attendance(self):
-        a = AttendanceTotal.objects.get(student=self.student, course=self.course)
+        if hasattr(self, 'total_class'):
+            a = AttendanceTotal(att_class=self.att_class or 0, total_class=self.total_class or 0)
+        else:
+            a = AttendanceTotal.objects.get(student=self.student, course=self.course)
         return a.attendance
 
 
@@ -243,11 +667,27 @@ class Marks(models.Model):
         return 20
 
 
+class MarksClassManager(models.Manager):
+    def provision(self, assigns):
+        """
+        Create the MarksClass rows, one per test, that the given assigns are
+        missing. Returns the number of rows created.
+        """
+        assign_ids = [a.pk for a in assigns]
+        existing = set(self.filter(assign__in=assign_ids).values_list('assign_id', 'name'))
+        m_list = [MarksClass(assign_id=assign_id, name=name[0]) for assign_id in assign_ids for name in test_name
+                  if (assign_id, name[0]) not in existing]
+        self.bulk_create(m_list, batch_size=500)
+        return len(m_list)
+
+
 class MarksClass(models.Model):
     assign = models.ForeignKey(Assign, on_delete=models.CASCADE)
     name = models.CharField(max_length=50, choices=test_name, default='Internal test 1')
     status = models.BooleanField(default='False')
 
+    objects = MarksClassManager()
+
     class Meta:
         unique_together = (('assign', 'name'),)
 
@@ -257,18 +697,113 @@ class MarksClass(models.Model):
             return 100
         return 20
 
+    def sheet(self):
+        """
+        Return the Marks rows of this test for every student of the class,
+        with the studentcourse and student loaded in the same query.
+        """
+        ass = self.assign
+        return list(Marks.objects.filter(name=self.name, studentcourse__course_id=ass.course_id,
+                                         studentcourse__student__class_id_id=ass.class_id_id)
+                    .select_related('studentcourse__student')
+                    .order_by('studentcourse__student_id'))
+
+    def submit(self, marks):
+        """
+        Record the marks of this test. ``marks`` maps each student's USN to the
+        marks scored; the changed rows are written in one bulk update and the
+        test marked as entered in one transaction.
+        """
+        m_list = self.sheet()
+        to_update = []
+        for m in m_list:
+            mark = int(marks[m.studentcourse.student_id])
+            if m.marks1 != mark:
+                m.marks1 = mark
+                to_update.append(m)
+
+        with transaction.atomic():
+            Marks.objects.bulk_update(to_update, ['marks1'], batch_size=500)
+            self.status = True
+            self.save(update_fields=['status'])
+        caching.bump('student', *[m.studentcourse.student_id for m in to_update])
+        caching.bump('course', self.assign.course_id)
+        return m_list
+
 
 class AttendanceRange(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
 
 
-# Triggers
+class JobManager(models.Manager):
+    def enqueue(self, kind, **args):
+        """Queue a job for the worker; ``args`` must be JSON serializable."""
+        return self.create(kind=kind, args=args)
+
+    def claim(self, worker):
+        """
+        Mark the oldest queued job as running by ``worker`` and return it, or
+        None if the queue is empty. The claim is a conditional UPDATE, so two
+        workers never run the same job.
+        """
+        while True:
+            job_id = self.filter(status='queued').order_by('id').values_list('id', flat=True).first()
+            if job_id is None:
+                return None
+            if self.filter(id=job_id, status='queued').update(status='running', worker=worker,
+                                                              started=timezone.now(), updated=timezone.now()):
+                return self.get(id=job_id)
+
+    def requeue_stale(self, age):
+        """Queue again the running jobs that have not reported progress for ``age``, e.g. of a dead worker."""
+        return self.filter(status='running', updated__lt=timezone.now() - age).update(status='queued', worker='')
+
+
+class Job(models.Model):
+    kind = models.CharField(max_length=50, choices=job_kinds)
+    args = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=job_status, default='queued')
+    done = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    message = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status'),
+        ]
+
+    def __str__(self):
+        return '#%d %s' % (self.id, self.get_kind_display())
+
+    @property
+    def progress(self):
+        return round(100 * self.done / self.total) if self.total else 0
+
+    def advance(self, done, total=None):
+        """Record ``done`` more steps of work, out of ``total`` if it is now known."""
+        self.done += done
+        changes = {'done': F('done') + done, 'updated': timezone.now()}
+        if total is not None:
+            self.total = changes['total'] = total
+        Job.objects.filter(id=self.id).update(**changes)
+
+    def finish(self, status, message=''):
+        self.status = status
+        self.message = message
+        self.finished = timezone.now()
+        Job.objects.filter(id=self.id).update(status=status, message=message, finished=self.finished,
+                                              updated=self.finished)
 
 
-def daterange(start_date, end_date):
-    for n in range(int((end_date - start_date).days)):
-        yield start_date + timedelta(n)
+# Triggers
 
 
 days = {
@@ -283,58 +818,24 @@ days = {
 
 def create_attendance(sender, instance, **kwargs):
     if kwargs['created']:
-        start_date = AttendanceRange.objects.all()[:1].get().start_date
-        end_date = AttendanceRange.objects.all()[:1].get().end_date
-        for single_date in daterange(start_date, end_date):
-            if single_date.isoweekday() == days[instance.day]:
-                try:
-                    AttendanceClass.objects.get(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
-                except AttendanceClass.DoesNotExist:
-                    a = AttendanceClass(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
-                    a.save()
+        r = AttendanceRange.objects.first()
+        if r is not None:
+            AttendanceClass.objects.generate(r.start_date, r.end_date, [instance])
 
 
 def create_marks(sender, instance, **kwargs):
-    if kwargs['created']:
-        if hasattr(instance, 'name'):
-            ass_list = instance.class_id.assign_set.all()
-            for ass in ass_list:
-                try:
-                    StudentCourse.objects.get(student=instance, course=ass.course)
-                except StudentCourse.DoesNotExist:
-                    sc = StudentCourse(student=instance, course=ass.course)
-                    sc.save()
-                    sc.marks_set.create(name='Internal test 1')
-                    sc.marks_set.create(name='Internal test 2')
-                    sc.marks_set.create(name='Internal test 3')
-                    sc.marks_set.create(name='Event 1')
-                    sc.marks_set.create(name='Event 2')
-                    sc.marks_set.create(name='Semester End Exam')
-        elif hasattr(instance, 'course'):
-            stud_list = instance.class_id.student_set.all()
-            cr = instance.course
-            for s in stud_list:
-                try:
-                    StudentCourse.objects.get(student=s, course=cr)
-                except StudentCourse.DoesNotExist:
-                    sc = StudentCourse(student=s, course=cr)
-                    sc.save()
-                    sc.marks_set.create(name='Internal test 1')
-                    sc.marks_set.create(name='Internal test 2')
-                    sc.marks_set.create(name='Internal test 3')
-                    sc.marks_set.create(name='Event 1')
-                    sc.marks_set.create(name='Event 2')
-                    sc.marks_set.create(name='Semester End Exam')
+    # On every save, not only on creation: a student moved to another class,
+    # or an assign to another class or course, needs the rows of its new one.
+    # Only missing rows are created.
+    if hasattr(instance, 'name'):
+        StudentCourse.objects.provision(students=[instance])
+    elif hasattr(instance, 'course'):
+        StudentCourse.objects.provision(assigns=[instance])
 
 
 def create_marks_class(sender, instance, **kwargs):
     if kwargs['created']:
-        for name in test_name:
-            try:
-                MarksClass.objects.get(assign=instance, name=name[0])
-            except MarksClass.DoesNotExist:
-                m = MarksClass(assign=instance, name=name[0])
-                m.save()
+        MarksClass.objects.provision([instance])
 
 
 def delete_marks(sender, instance, **kwargs):
@@ -342,8 +843,58 @@ def delete_marks(sender, instance, **kwargs):
     StudentCourse.objects.filter(course=instance.course, student__in=stud_list).delete()
 
 
+def invalidate_student(sender, instance, **kwargs):
+    caching.bump('student', instance.USN)
+    caching.bump('class', instance.class_id_id)
+
+
+def invalidate_assign(sender, instance, **kwargs):
+    caching.bump('assign', instance.id)
+    caching.bump('class', instance.class_id_id)
+    caching.bump('timetable', 'all')
+
+
+def invalidate_timetable(sender, **kwargs):
+    caching.bump('timetable', 'all')
+
+
+def invalidate_attendance_class(sender, instance, **kwargs):
+    caching.bump('assign', instance.assign_id)
+
+
+def invalidate_attendance(sender, instance, **kwargs):
+    caching.bump('student', instance.student_id)
+    caching.bump('course', instance.course_id)
+
+
+def recount_attendance(sender, instance, **kwargs):
+    # Whatever deleted the row, e.g. the admin deleting its class, assign or
+    # student, the stored counters follow once the deletion commits.
+    AttendanceTotal.objects.refresh_on_commit(instance.student_id, instance.course_id)
+
+
+def invalidate_marks(sender, instance, **kwargs):
+    sc = StudentCourse.objects.filter(id=instance.studentcourse_id).values_list('student_id', 'course_id').first()
+    if sc is not None:
+        caching.bump('student', sc[0])
+        caching.bump('course', sc[1])
+
+
 post_save.connect(create_marks, sender=Student)
 post_save.connect(create_marks, sender=Assign)
 post_save.connect(create_marks_class, sender=Assign)
 post_save.connect(create_attendance, sender=AssignTime)
 post_delete.connect(delete_marks, sender=Assign)
+post_save.connect(invalidate_student, sender=Student)
+post_delete.connect(invalidate_student, sender=Student)
+post_save.connect(invalidate_assign, sender=Assign)
+post_delete.connect(invalidate_assign, sender=Assign)
+post_save.connect(invalidate_timetable, sender=AssignTime)
+post_delete.connect(invalidate_timetable, sender=AssignTime)
+post_save.connect(invalidate_attendance_class, sender=AttendanceClass)
+post_delete.connect(invalidate_attendance_class, sender=AttendanceClass)
+post_save.connect(invalidate_attendance, sender=Attendance)
+post_delete.connect(invalidate_attendance, sender=Attendance)
+post_delete.connect(recount_attendance, sender=Attendance)
+post_save.connect(invalidate_marks, sender=Marks)
+post_delete.connect(invalidate_marks, sender=Marks)
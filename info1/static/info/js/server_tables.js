@@ -0,0 +1,45 @@
+// Tables with a data-source attribute are paged, sorted and searched on the
+// server (DataTables server-side mode, see info/datatables.py). The first
+// page comes with the HTML. Moving on to the next page sends the cursor of
+// the last row shown, so the server reads on from it instead of skipping
+// the rows of all the pages before.
+$(function () {
+    $('table[data-source]').each(function () {
+        var table = $(this);
+        var order = table.data('order') || [[0, 'asc']];
+        var shown = {start: 0, length: table.data('page-length'), order: JSON.stringify(order), search: ''};
+        var cursor = table.data('next');
+
+        table.DataTable({
+            serverSide: true,
+            deferLoading: table.data('total'),
+            pageLength: table.data('page-length'),
+            order: order,
+            ajax: function (data, callback) {
+                var request = {
+                    start: data.start,
+                    length: data.length,
+                    order: JSON.stringify($.map(data.order, function (o) { return [[o.column, o.dir]]; })),
+                    search: data.search.value
+                };
+                var params = {
+                    draw: data.draw,
+                    start: data.start,
+                    length: data.length,
+                    'order[0][column]': data.order.length ? data.order[0].column : '',
+                    'order[0][dir]': data.order.length ? data.order[0].dir : '',
+                    'search[value]': data.search.value
+                };
+                if (cursor && request.start === shown.start + shown.length && request.order === shown.order
+                        && request.search === shown.search) {
+                    params.after = cursor;
+                }
+                $.getJSON(table.data('source'), params, function (json) {
+                    shown = request;
+                    cursor = json.next;
+                    callback(json);
+                });
+            }
+        });
+    });
+});
@@ -0,0 +1,123 @@
+"""
+Seeded synthetic college data, for benchmarks and query budget tests.
+
+The same arguments always produce the same rows, so numbers measured on two
+checkouts are comparable.
+"""
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import caching
+from .models import Dept, Class, Course, Teacher, Student, User, Assign, AssignTime, AttendanceClass, \
+    AttendanceRange, Attendance, AttendanceTotal, Marks, MarksClass, StudentCourse, DAYS_OF_WEEK, time_slots, \
+    test_name
+
+LESSONS_PER_WEEK = 3
+PASSWORD = 'benchmark'
+
+
+def generate(seed=0, depts=2, classes=2, students=60, courses=5, weeks=16, start=date(2020, 8, 3), users=True):
+    """
+    Fill an empty database with ``depts`` departments, each with ``classes``
+    classes of ``students`` students and ``courses`` courses. Every course of
+    a department is taught to all its classes by one teacher, three times a
+    week, for a semester of ``weeks`` weeks starting on ``start``. All the
+    classes of the semester have been taken and every test has been marked.
+
+    With ``users``, every student and teacher gets a login named after its
+    USN or id, with the password ``PASSWORD``. Returns the number of rows
+    created per model.
+    """
+    assert courses <= len(time_slots) and classes <= len(time_slots)
+    rng = random.Random(seed)
+    end = start + timedelta(weeks=weeks)
+
+    with transaction.atomic():
+        d_list, c_list, cr_list, t_list, s_list, a_list = [], [], [], [], [], []
+        index = {}
+        for i in range(depts):
+            d = Dept(id='D%d' % i, name='Department %d' % i)
+            d_list.append(d)
+            for j in range(courses):
+                index['%sC%d' % (d.id, j)] = j
+                cr_list.append(Course(id='%sC%d' % (d.id, j), dept=d, name='Course %d.%d' % (i, j),
+                                      shortname='C%d' % j))
+                t_list.append(Teacher(id='%sT%d' % (d.id, j), dept=d, name='Teacher %d.%d' % (i, j)))
+            for k in range(classes):
+                c = Class(id='%sS%d' % (d.id, k), dept=d, section=chr(ord('A') + k), sem=5)
+                c_list.append(c)
+                index[c.id] = k
+                for n in range(students):
+                    s_list.append(Student(USN='%sU%03d' % (c.id, n), class_id=c, name='Student %s.%d' % (c.id, n),
+                                          DOB=date(1998, 1, 1) + timedelta(rng.randrange(730))))
+                for j in range(courses):
+                    a_list.append(Assign(class_id=c, course_id='%sC%d' % (d.id, j), teacher_id='%sT%d' % (d.id, j)))
+
+        if users:
+            profiles = t_list + s_list
+            # Hash once; every synthetic user shares the password.
+            password = make_password(PASSWORD)
+            User.objects.bulk_create([User(username=p.pk, first_name=p.name, password=password) for p in profiles],
+                                     batch_size=500)
+            user_ids = dict(User.objects.values_list('username', 'id'))
+            for p in profiles:
+                p.user_id = user_ids[p.pk]
+
+        Dept.objects.bulk_create(d_list)
+        Course.objects.bulk_create(cr_list, batch_size=500)
+        Teacher.objects.bulk_create(t_list, batch_size=500)
+        Class.objects.bulk_create(c_list, batch_size=500)
+        Student.objects.bulk_create(s_list, batch_size=500)
+        Assign.objects.bulk_create(a_list, batch_size=500)
+        a_list = list(Assign.objects.order_by('class_id', 'course'))
+
+        # Course j of class k is taught in period j + k on every other day, so
+        # that neither a class nor a teacher has two lessons at once.
+        at_list = []
+        for a in a_list:
+            j, k = index[a.course_id], index[a.class_id_id]
+            period = time_slots[(j + k) % len(time_slots)][0]
+            for lesson in range(LESSONS_PER_WEEK):
+                day = DAYS_OF_WEEK[(j + k + 2 * lesson) % len(DAYS_OF_WEEK)][0]
+                at_list.append(AssignTime(assign=a, day=day, period=period))
+        AssignTime.objects.bulk_create(at_list, batch_size=500)
+
+        MarksClass.objects.provision(a_list)
+        StudentCourse.objects.provision(assigns=a_list)
+        AttendanceRange.objects.create(start_date=start, end_date=end)
+        AttendanceClass.objects.generate(start, end)
+
+        studs = {}
+        for usn, class_id in Student.objects.values_list('USN', 'class_id'):
+            studs.setdefault(class_id, []).append(usn)
+        att_list = []
+        for assc_id, date_, class_id, course_id in AttendanceClass.objects.order_by('id') \
+                .values_list('id', 'date', 'assign__class_id', 'assign__course'):
+            att_list.extend(Attendance(attendanceclass_id=assc_id, course_id=course_id, student_id=usn, date=date_,
+                                       status=rng.random() < 0.85) for usn in studs[class_id])
+        Attendance.objects.bulk_create(att_list, batch_size=1000)
+        AttendanceClass.objects.update(status=1)
+        AttendanceTotal.objects.rebuild()
+
+        m_list = list(Marks.objects.order_by('id'))
+        for m in m_list:
+            m.marks1 = rng.randint(20, 100) if m.name == test_name[-1][0] else rng.randint(5, 20)
+        Marks.objects.bulk_update(m_list, ['marks1'], batch_size=1000)
+        MarksClass.objects.update(status=True)
+
+    caching.bump('timetable', 'all')
+    return {
+        'dept': len(d_list),
+        'class': len(c_list),
+        'course': len(cr_list),
+        'teacher': len(t_list),
+        'student': len(s_list),
+        'assign': len(a_list),
+        'assigntime': len(at_list),
+        'attendanceclass': AttendanceClass.objects.count(),
+        'attendance': len(att_list),
+        'marks': len(m_list),
+    }
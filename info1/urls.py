@@ -5,7 +5,10 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('student/<slug:stud_id>/attendance/', views.attendance, name='attendance'),
+    path('student/<slug:stud_id>/summary/', views.student_summary, name='student_summary'),
     path('student/<slug:stud_id>/<slug:course_id>/attendance/', views.attendance_detail, name='attendance_detail'),
+    path('student/<slug:stud_id>/<slug:course_id>/attendance/data/', views.attendance_detail_data,
+         name='attendance_detail_data'),
     path('student/<slug:class_id>/timetable/', views.timetable, name='timetable'),
     # path('student/<slug:class_id>/search/', views.student_search, name='student_search'),
 
@@ -14,21 +17,28 @@ urlpatterns = [
     path('teacher/<slug:teacher_id>/<int:choice>/Classes/', views.t_clas, name='t_clas'),
     path('teacher/<int:assign_id>/Students/attendance/', views.t_student, name='t_student'),
     path('teacher/<int:assign_id>/ClassDates/', views.t_class_date, name='t_class_date'),
+    path('teacher/<int:assign_id>/ClassDates/data/', views.t_class_date_data, name='t_class_date_data'),
     path('teacher/<int:ass_c_id>/Cancel/', views.cancel_class, name='cancel_class'),
     path('teacher/<int:ass_c_id>/attendance/', views.t_attendance, name='t_attendance'),
     path('teacher/<int:ass_c_id>/Edit_att/', views.edit_att, name='edit_att'),
     path('teacher/<int:ass_c_id>/attendance/confirm/', views.confirm, name='confirm'),
     path('teacher/<slug:stud_id>/<slug:course_id>/attendance/', views.t_attendance_detail, name='t_attendance_detail'),
+    path('teacher/<slug:stud_id>/<slug:course_id>/attendance/data/', views.t_attendance_detail_data,
+         name='t_attendance_detail_data'),
     path('teacher/<int:att_id>/change_attendance/', views.change_att, name='change_att'),
     path('teacher/<int:assign_id>/Extra_class/', views.t_extra_class, name='t_extra_class'),
     path('teacher/<slug:assign_id>/Extra_class/confirm/', views.e_confirm, name='e_confirm'),
     path('teacher/<int:assign_id>/Report/', views.t_report, name='t_report'),
+    path('teacher/<int:assign_id>/Report/attendance.csv', views.export_attendance, name='export_attendance'),
+    path('teacher/<int:assign_id>/Report/marks.csv', views.export_marks, name='export_marks'),
+    path('dept/<slug:dept_id>/report.csv', views.export_dept_report, name='export_dept_report'),
 
     path('teacher/<slug:teacher_id>/t_timetable/', views.t_timetable, name='t_timetable'),
     path('teacher/<int:asst_id>/Free_teachers/', views.free_teachers, name='free_teachers'),
 
     path('teacher/<int:assign_id>/marks_list/', views.t_marks_list, name='t_marks_list'),
     path('teacher/<int:assign_id>/Students/Marks/', views.student_marks, name='t_student_marks'),
+    path('teacher/<int:assign_id>/Students/Marks/data/', views.student_marks_data, name='t_student_marks_data'),
     path('teacher/<int:marks_c_id>/marks_entry/', views.t_marks_entry, name='t_marks_entry'),
     path('teacher/<int:marks_c_id>/marks_entry/confirm/', views.marks_confirm, name='marks_confirm'),
     path('teacher/<int:marks_c_id>/Edit_marks/', views.edit_marks, name='edit_marks'),
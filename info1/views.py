@@ -1,15 +1,27 @@
+import math
+import uuid
+
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
-from .models import Dept, Class, Student, Attendance, Course, Teacher, Assign, AttendanceTotal, time_slots, \
-    DAYS_OF_WEEK, AssignTime, AttendanceClass, StudentCourse, Marks, MarksClass
+from django.http import HttpResponseRedirect, JsonResponse
+from .models import Dept, Student, Attendance, Course, Teacher, Assign, AttendanceTotal, AssignTime, \
+    AttendanceClass, AttendanceConflict, StudentCourse, Marks, MarksClass, test_name, cie_tests
 from django.urls import reverse
+from . import caching, datatables, exports
 from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.html import format_html
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, Q
 
 
 # Create your views here.
 
 
+def _assign_depends(ass):
+    return [('assign', ass.id), ('class', ass.class_id_id), ('course', ass.course_id)]
+
+
 @login_required
 def index(request):
     if request.user.is_teacher:
@@ -22,24 +34,90 @@ def index(request):
 @login_required()
 def attendance(request, stud_id):
     stud = Student.objects.get(USN=stud_id)
-    ass_list = Assign.objects.filter(class_id_id=stud.class_id)
-    att_list = []
-    for ass in ass_list:
-        try:
-            a = AttendanceTotal.objects.get(student=stud, course=ass.course)
-        except AttendanceTotal.DoesNotExist:
-            a = AttendanceTotal(student=stud, course=ass.course)
-            a.save()
-        att_list.append(a)
+
+    def fetch():
+        ass_list = Assign.objects.filter(class_id_id=stud.class_id)
+        return AttendanceTotal.objects.fetch([stud], [ass.course_id for ass in ass_list])
+
+    att_list = caching.cached('attendance:%s' % stud.USN, [('student', stud.USN), ('class', stud.class_id_id)],
+                              fetch)
     return render(request, 'info/attendance.html', {'att_list': att_list})
 
 
+@login_required()
+def student_summary(request, stud_id):
+    stud = get_object_or_404(Student, USN=stud_id)
+    summary = caching.cached('summary:%s' % stud.USN, [('student', stud.USN), ('class', stud.class_id_id)],
+                             lambda: _student_summary(stud))
+    return JsonResponse(summary)
+
+
+def _student_summary(stud):
+    cr_list = Course.objects.filter(assign__class_id=stud.class_id_id).distinct().order_by('id')
+    att_counts = Attendance.objects.filter(student=stud).exclude(attendanceclass__status=2).values_list('course_id') \
+        .annotate(attended=Count('id', filter=Q(status=True)), total=Count('id')).order_by()
+    att_counts = {course_id: (attended, total) for course_id, attended, total in att_counts}
+    marks = {}
+    for course_id, name, marks1 in Marks.objects.filter(studentcourse__student=stud) \
+            .values_list('studentcourse__course_id', 'name', 'marks1'):
+        marks.setdefault(course_id, {})[name] = marks1
+
+    courses = []
+    for cr in cr_list:
+        attended, total = att_counts.get(cr.id, (0, 0))
+        a = AttendanceTotal(student=stud, course=cr)
+        a.set_counts(attended, total)
+        m = marks.get(cr.id, {})
+        courses.append({
+            'id': cr.id,
+            'name': cr.name,
+            'shortname': cr.shortname,
+            'attended_classes': a.att_class,
+            'total_classes': a.total_class,
+            'attendance': a.attendance,
+            'classes_to_attend': a.classes_to_attend,
+            'cie': math.ceil(sum(m.get(name, 0) for name in cie_tests) / 2),
+            'marks': {name[0]: m[name[0]] for name in test_name if name[0] in m},
+        })
+    return {
+        'usn': stud.USN,
+        'name': stud.name,
+        'class_id': stud.class_id_id,
+        'courses': courses,
+    }
+
+
+def _att_detail_cells(a, n):
+    if a.status:
+        status = format_html('<span class="badge badge-success">Present</span>')
+    else:
+        status = format_html('<span class="badge badge-danger">Absent</span>')
+    return [n, date_format(a.date), date_format(a.date, 'l'), status]
+
+
+def _t_att_detail_cells(a, n):
+    return _att_detail_cells(a, n) + [
+        format_html('<a class="btn btn-warning" href="{}">Change</a>', reverse('change_att', args=(a.id,)))]
+
+
+att_detail_table = datatables.Table([None, 'date', None, 'status'], _att_detail_cells, search=('date',))
+t_att_detail_table = datatables.Table([None, 'date', None, 'status', None], _t_att_detail_cells, search=('date',))
+
+
 @login_required()
 def attendance_detail(request, stud_id, course_id):
     stud = get_object_or_404(Student, USN=stud_id)
     cr = get_object_or_404(Course, id=course_id)
-    att_list = Attendance.objects.filter(course=cr, student=stud).order_by('date')
-    return render(request, 'info/att_detail.html', {'att_list': att_list, 'cr': cr})
+    context = att_detail_table.first_page(Attendance.objects.filter(course=cr, student=stud))
+    context.update(att_list=context['object_list'], cr=cr, stud=stud)
+    return render(request, 'info/att_detail.html', context)
+
+
+@login_required()
+def attendance_detail_data(request, stud_id, course_id):
+    stud = get_object_or_404(Student, USN=stud_id)
+    cr = get_object_or_404(Course, id=course_id)
+    return att_detail_table.response(request, Attendance.objects.filter(course=cr, student=stud))
 
 
 # Teacher Views
@@ -53,30 +131,50 @@ def t_clas(request, teacher_id, choice):
 @login_required()
 def t_student(request, assign_id):
     ass = Assign.objects.get(id=assign_id)
-    att_list = []
-    for stud in ass.class_id.student_set.all():
-        try:
-            a = AttendanceTotal.objects.get(student=stud, course=ass.course)
-        except AttendanceTotal.DoesNotExist:
-            a = AttendanceTotal(student=stud, course=ass.course)
-            a.save()
-        att_list.append(a)
+
+    def fetch():
+        stud_list = list(Student.objects.filter(class_id_id=ass.class_id_id).values_list('USN', flat=True))
+        return AttendanceTotal.objects.fetch(stud_list, [ass.course_id])
+
+    att_list = caching.cached('t_student:%d' % ass.id, _assign_depends(ass), fetch)
     return render(request, 'info/t_students.html', {'att_list': att_list})
 
 
+def _class_date_cells(a, n):
+    if a.status == 1:
+        return [date_format(a.date), format_html('<span class="badge badge-success">Marked</span>'),
+                format_html('<a class="btn btn-secondary" href="{}" role="button">Edit Attendance</a>',
+                            reverse('edit_att', args=(a.id,)))]
+    enter = format_html('<a class="btn btn-primary" href="{}" role="button">Enter Attendance</a>',
+                        reverse('t_attendance', args=(a.id,)))
+    if a.status == 0:
+        return [date_format(a.date), format_html('<span class="badge badge-danger">Not Marked</span>'),
+                format_html('{} <a class="btn btn-warning" href="{}">Cancel Class</a>', enter,
+                            reverse('cancel_class', args=(a.id,)))]
+    return [date_format(a.date), format_html('<span class="badge badge-warning">Cancelled</span>'), enter]
+
+
+class_date_table = datatables.Table(['date', 'status', None], _class_date_cells, descending=True, search=('date',))
+
+
 @login_required()
 def t_class_date(request, assign_id):
-    now = timezone.now()
     ass = get_object_or_404(Assign, id=assign_id)
-    att_list = ass.attendanceclass_set.filter(date__lte=now).order_by('-date')
-    return render(request, 'info/t_class_date.html', {'att_list': att_list})
+    context = class_date_table.first_page(ass.attendanceclass_set.filter(date__lte=timezone.now()))
+    context['ass'] = ass
+    return render(request, 'info/t_class_date.html', context)
+
+
+@login_required()
+def t_class_date_data(request, assign_id):
+    ass = get_object_or_404(Assign, id=assign_id)
+    return class_date_table.response(request, ass.attendanceclass_set.filter(date__lte=timezone.now()))
 
 
 @login_required()
 def cancel_class(request, ass_c_id):
-    assc = get_object_or_404(AttendanceClass, id=ass_c_id)
-    assc.status = 2
-    assc.save()
+    assc = get_object_or_404(AttendanceClass.objects.select_related('assign'), id=ass_c_id)
+    assc.cancel()
     return HttpResponseRedirect(reverse('t_class_date', args=(assc.assign_id,)))
 
 
@@ -89,47 +187,43 @@ def t_attendance(request, ass_c_id):
         'ass': ass,
         'c': c,
         'assc': assc,
+        'key': uuid.uuid4().hex,
     }
     return render(request, 'info/t_attendance.html', context)
 
 
 @login_required()
 def edit_att(request, ass_c_id):
-    assc = get_object_or_404(AttendanceClass, id=ass_c_id)
-    cr = assc.assign.course
-    att_list = Attendance.objects.filter(attendanceclass=assc, course=cr)
+    assc = get_object_or_404(AttendanceClass.objects.select_related('assign'), id=ass_c_id)
+    att_list = Attendance.objects.filter(attendanceclass=assc, course=assc.assign.course_id).select_related('student')
     context = {
         'assc': assc,
         'att_list': att_list,
+        'key': uuid.uuid4().hex,
     }
     return render(request, 'info/t_edit_att.html', context)
 
 
+def _submission(request):
+    """The idempotency key and the version of the class the posted form was rendered with."""
+    try:
+        version = int(request.POST['version'])
+    except (KeyError, ValueError):
+        version = None
+    return request.POST.get('key', '')[:64], version
+
+
 @login_required()
 def confirm(request, ass_c_id):
-    assc = get_object_or_404(AttendanceClass, id=ass_c_id)
+    assc = get_object_or_404(AttendanceClass.objects.select_related('assign'), id=ass_c_id)
     ass = assc.assign
-    cr = ass.course
-    cl = ass.class_id
-    for i, s in enumerate(cl.student_set.all()):
-        status = request.POST[s.USN]
-        if status == 'present':
-            status = 'True'
-        else:
-            status = 'False'
-        if assc.status == 1:
-            try:
-                a = Attendance.objects.get(course=cr, student=s, date=assc.date, attendanceclass=assc)
-                a.status = status
-                a.save()
-            except Attendance.DoesNotExist:
-                a = Attendance(course=cr, student=s, status=status, date=assc.date, attendanceclass=assc)
-                a.save()
-        else:
-            a = Attendance(course=cr, student=s, status=status, date=assc.date, attendanceclass=assc)
-            a.save()
-            assc.status = 1
-            assc.save()
+    stud_list = Student.objects.filter(class_id_id=ass.class_id_id).values_list('USN', flat=True)
+    key, version = _submission(request)
+    try:
+        assc.submit({usn: request.POST[usn] == 'present' for usn in stud_list}, key, version)
+    except AttendanceConflict:
+        # Someone else took the roll call since the form was shown: show theirs.
+        return HttpResponseRedirect(reverse('edit_att', args=(assc.id,)))
 
     return HttpResponseRedirect(reverse('t_class_date', args=(ass.id,)))
 
@@ -138,15 +232,26 @@ def confirm(request, ass_c_id):
 def t_attendance_detail(request, stud_id, course_id):
     stud = get_object_or_404(Student, USN=stud_id)
     cr = get_object_or_404(Course, id=course_id)
-    att_list = Attendance.objects.filter(course=cr, student=stud).order_by('date')
-    return render(request, 'info/t_att_detail.html', {'att_list': att_list, 'cr': cr})
+    context = t_att_detail_table.first_page(Attendance.objects.filter(course=cr, student=stud))
+    context.update(cr=cr, stud=stud)
+    return render(request, 'info/t_att_detail.html', context)
+
+
+@login_required()
+def t_attendance_detail_data(request, stud_id, course_id):
+    stud = get_object_or_404(Student, USN=stud_id)
+    cr = get_object_or_404(Course, id=course_id)
+    return t_att_detail_table.response(request, Attendance.objects.filter(course=cr, student=stud))
 
 
 @login_required()
 def change_att(request, att_id):
     a = get_object_or_404(Attendance, id=att_id)
     a.status = not a.status
-    a.save()
+    with transaction.atomic():
+        a.save()
+        AttendanceClass.objects.filter(id=a.attendanceclass_id).update(version=F('version') + 1)
+        AttendanceTotal.objects.refresh([a.student_id], [a.course_id])
     return HttpResponseRedirect(reverse('t_attendance_detail', args=(a.student.USN, a.course_id)))
 
 
@@ -157,6 +262,7 @@ def t_extra_class(request, assign_id):
     context = {
         'ass': ass,
         'c': c,
+        'key': uuid.uuid4().hex,
     }
     return render(request, 'info/t_extra_class.html', context)
 
@@ -164,20 +270,10 @@ def t_extra_class(request, assign_id):
 @login_required()
 def e_confirm(request, assign_id):
     ass = get_object_or_404(Assign, id=assign_id)
-    cr = ass.course
-    cl = ass.class_id
-    assc = ass.attendanceclass_set.create(status=1, date=request.POST['date'])
-    assc.save()
-
-    for i, s in enumerate(cl.student_set.all()):
-        status = request.POST[s.USN]
-        if status == 'present':
-            status = 'True'
-        else:
-            status = 'False'
-        date = request.POST['date']
-        a = Attendance(course=cr, student=s, status=status, date=date, attendanceclass=assc)
-        a.save()
+    stud_list = Student.objects.filter(class_id_id=ass.class_id_id).values_list('USN', flat=True)
+    roll = {usn: request.POST[usn] == 'present' for usn in stud_list}
+    key, _ = _submission(request)
+    AttendanceClass.objects.take_extra(ass, request.POST['date'], roll, key)
 
     return HttpResponseRedirect(reverse('t_clas', args=(ass.teacher_id, 1)))
 
@@ -185,71 +281,49 @@ def e_confirm(request, assign_id):
 @login_required()
 def t_report(request, assign_id):
     ass = get_object_or_404(Assign, id=assign_id)
-    sc_list = []
-    for stud in ass.class_id.student_set.all():
-        a = StudentCourse.objects.get(student=stud, course=ass.course)
-        sc_list.append(a)
-    return render(request, 'info/t_report.html', {'sc_list': sc_list})
+    sc_list = caching.cached('t_report:%d' % ass.id, _assign_depends(ass), lambda: list(
+        StudentCourse.objects.filter(student__class_id=ass.class_id_id, course=ass.course_id)
+        .with_cie().with_attendance().select_related('student').order_by('student_id')))
+    return render(request, 'info/t_report.html', {'sc_list': sc_list, 'ass': ass})
+
+
+@login_required()
+def export_attendance(request, assign_id):
+    ass = get_object_or_404(Assign, id=assign_id)
+    return exports.csv_response(exports.attendance_register(ass), 'attendance_%d.csv' % ass.id)
+
+
+@login_required()
+def export_marks(request, assign_id):
+    ass = get_object_or_404(Assign, id=assign_id)
+    return exports.csv_response(exports.marks_sheet(ass), 'marks_%d.csv' % ass.id)
+
+
+@login_required()
+def export_dept_report(request, dept_id):
+    dept = get_object_or_404(Dept, id=dept_id)
+    return exports.csv_response(exports.dept_report([dept.id]), 'report_%s.csv' % dept.id)
 
 
 @login_required()
 def timetable(request, class_id):
-    asst = AssignTime.objects.filter(assign__class_id=class_id)
-    matrix = [['' for i in range(12)] for j in range(6)]
-
-    for i, d in enumerate(DAYS_OF_WEEK):
-        t = 0
-        for j in range(12):
-            if j == 0:
-                matrix[i][0] = d[0]
-                continue
-            if j == 4 or j == 8:
-                continue
-            try:
-                a = asst.get(period=time_slots[t][0], day=d[0])
-                matrix[i][j] = a.assign.course_id
-            except AssignTime.DoesNotExist:
-                pass
-            t += 1
-
-    context = {'matrix': matrix}
+    context = {'matrix': AssignTime.objects.grid(assign__class_id=class_id)}
     return render(request, 'info/timetable.html', context)
 
 
 @login_required()
 def t_timetable(request, teacher_id):
-    asst = AssignTime.objects.filter(assign__teacher_id=teacher_id)
-    class_matrix = [[True for i in range(12)] for j in range(6)]
-    for i, d in enumerate(DAYS_OF_WEEK):
-        t = 0
-        for j in range(12):
-            if j == 0:
-                class_matrix[i][0] = d[0]
-                continue
-            if j == 4 or j == 8:
-                continue
-            try:
-                a = asst.get(period=time_slots[t][0], day=d[0])
-                class_matrix[i][j] = a
-            except AssignTime.DoesNotExist:
-                pass
-            t += 1
-
     context = {
-        'class_matrix': class_matrix,
+        'class_matrix': AssignTime.objects.grid(assign__teacher_id=teacher_id),
     }
     return render(request, 'info/t_timetable.html', context)
 
 
 @login_required()
 def free_teachers(request, asst_id):
-    asst = get_object_or_404(AssignTime, id=asst_id)
-    ft_list = []
-    t_list = Teacher.objects.filter(assign__class_id__id=asst.assign.class_id_id)
-    for t in t_list:
-        at_list = AssignTime.objects.filter(assign__teacher=t)
-        if not any([True if at.period == asst.period and at.day == asst.day else False for at in at_list]):
-            ft_list.append(t)
+    asst = get_object_or_404(AssignTime.objects.select_related('assign'), id=asst_id)
+    ft_list = Teacher.objects.filter(assign__class_id=asst.assign.class_id_id) \
+        .free_at(asst.day, asst.period).distinct()
 
     return render(request, 'info/free_teachers.html', {'ft_list': ft_list})
 
@@ -260,21 +334,12 @@ def free_teachers(request, asst_id):
 @login_required()
 def marks_list(request, stud_id):
     stud = Student.objects.get(USN=stud_id, )
-    ass_list = Assign.objects.filter(class_id_id=stud.class_id)
-    sc_list = []
-    for ass in ass_list:
-        try:
-            sc = StudentCourse.objects.get(student=stud, course=ass.course)
-        except StudentCourse.DoesNotExist:
-            sc = StudentCourse(student=stud, course=ass.course)
-            sc.save()
-            sc.marks_set.create(type='I', name='Internal test 1')
-            sc.marks_set.create(type='I', name='Internal test 2')
-            sc.marks_set.create(type='I', name='Internal test 3')
-            sc.marks_set.create(type='E', name='Event 1')
-            sc.marks_set.create(type='E', name='Event 2')
-            sc.marks_set.create(type='S', name='Semester End Exam')
-        sc_list.append(sc)
+
+    # The rows are created when the student or the assigns of its class are saved, see models.create_marks.
+    sc_list = caching.cached('marks_list:%s' % stud.USN, [('student', stud.USN), ('class', stud.class_id_id)],
+                             lambda: list(StudentCourse.objects
+                                          .filter(student=stud, course__assign__class_id=stud.class_id_id)
+                                          .distinct().select_related('course').prefetch_related('marks_set')))
 
     return render(request, 'info/marks_list.html', {'sc_list': sc_list})
 
@@ -304,41 +369,45 @@ def t_marks_entry(request, marks_c_id):
 
 @login_required()
 def marks_confirm(request, marks_c_id):
-    mc = get_object_or_404(MarksClass, id=marks_c_id)
-    ass = mc.assign
-    cr = ass.course
-    cl = ass.class_id
-    for s in cl.student_set.all():
-        mark = request.POST[s.USN]
-        sc = StudentCourse.objects.get(course=cr, student=s)
-        m = sc.marks_set.get(name=mc.name)
-        m.marks1 = mark
-        m.save()
-    mc.status = True
-    mc.save()
+    mc = get_object_or_404(MarksClass.objects.select_related('assign'), id=marks_c_id)
+    mc.submit(request.POST)
 
-    return HttpResponseRedirect(reverse('t_marks_list', args=(ass.id,)))
+    return HttpResponseRedirect(reverse('t_marks_list', args=(mc.assign_id,)))
 
 
 @login_required()
 def edit_marks(request, marks_c_id):
-    mc = get_object_or_404(MarksClass, id=marks_c_id)
-    cr = mc.assign.course
-    stud_list = mc.assign.class_id.student_set.all()
-    m_list = []
-    for stud in stud_list:
-        sc = StudentCourse.objects.get(course=cr, student=stud)
-        m = sc.marks_set.get(name=mc.name)
-        m_list.append(m)
+    mc = get_object_or_404(MarksClass.objects.select_related('assign'), id=marks_c_id)
     context = {
         'mc': mc,
-        'm_list': m_list,
+        'm_list': mc.sheet(),
     }
     return render(request, 'info/edit_marks.html', context)
 
 
+def _student_marks_cells(sc, n):
+    return [sc.student_id, format_html('<b>{}</b>', sc.student.name)] + [m.marks1 for m in sc.marks_set.all()]
+
+
+student_marks_table = datatables.Table(['student_id', 'student__name'] + [None] * len(test_name),
+                                       _student_marks_cells, key=('student_id',),
+                                       search=('student__USN', 'student__name'))
+
+
+def _student_marks(ass):
+    return StudentCourse.objects.filter(student__class_id=ass.class_id_id, course=ass.course_id) \
+        .select_related('student').prefetch_related(Prefetch('marks_set', Marks.objects.order_by('id')))
+
+
 @login_required()
 def student_marks(request, assign_id):
-    ass = Assign.objects.get(id=assign_id)
-    sc_list = StudentCourse.objects.filter(student__in=ass.class_id.student_set.all(), course=ass.course)
-    return render(request, 'info/t_student_marks.html', {'sc_list': sc_list})
+    ass = get_object_or_404(Assign, id=assign_id)
+    context = caching.cached('student_marks:%d' % ass.id, _assign_depends(ass),
+                             lambda: student_marks_table.first_page(_student_marks(ass)))
+    return render(request, 'info/t_student_marks.html', dict(context, ass=ass))
+
+
+@login_required()
+def student_marks_data(request, assign_id):
+    ass = get_object_or_404(Assign, id=assign_id)
+    return student_marks_table.response(request, _student_marks(ass))